@@ -0,0 +1,53 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from app.core.config import settings
+from app.models.playlist import DownloadStatusEnum
+
+
+class LRUCache[K, V]:
+    """Thread safe, size bounded least-recently-used cache"""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._items: OrderedDict[K, V] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> V | None:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key: K, value: V) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, key: K) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+@dataclass
+class TrackFileInfo:
+    file_path: str | None
+    status: DownloadStatusEnum | None
+    media_type: str
+    file_size: int = -1
+    mtime: float = 0
+
+
+# track_id -> downloaded file metadata used by the player endpoints
+track_file_cache: LRUCache[int, TrackFileInfo] = LRUCache(settings.track_cache_size)
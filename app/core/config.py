@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 import logging
 from pathlib import Path
+from typing import Literal
 
 import yt_dlp
 
@@ -24,17 +25,80 @@ class Settings(BaseSettings):
     download_folder: str = str(BASE_DIR / "musics")
     file_template: str = "%(title)s.%(ext)s"
     download_retries: int = 4
-    sync_interval: int = 30
+    download_priority_aging: float = 60  # seconds queued to gain one priority level
+    download_lease_duration: float = 60  # seconds a job stays claimed unless renewed
+    download_retry_delay: float = 30  # seconds before a retry, doubled per attempt
+    download_queue_poll_interval: float = 5  # seconds between checks of idle workers
+    # "process" runs yt-dlp out of the api process, a canceled download is killed
+    download_backend: Literal["thread", "process"] = "thread"
+    download_idle_processes: int = 4  # processes kept for the next downloads
+    # adjust the download workers from throughput and errors, within the bounds
+    download_autotune: bool = False
+    download_autotune_min: int = 1
+    download_autotune_max: int = 16
+    download_autotune_interval: float = 30  # seconds of each measured window
+    download_autotune_decrease: float = 0.5  # limit factor on throttling/errors
+    download_autotune_error_rate: float = 0.2  # failed attempts seen as congestion
+    download_autotune_min_gain: float = 0.05  # throughput gain to keep increasing
+    # bytes/s shared by all downloads as yt-dlp `ratelimit`s, 0 is unlimited
+    download_bandwidth_limit: int = 0
+    download_job_bandwidth_limit: int = 0  # bytes/s cap of each download
+    download_stream_reserve: float = 0.5  # budget share left to /player streams
+    download_stream_linger: float = 30  # seconds a stream counts after its request
+    sync_interval: int = 30  # minutes between background syncs, 0 disables them
+    sync_jitter: float = 0.1  # +-10% of the interval
+    sync_concurrent_playlists: int = 3  # sync jobs running at once
+    sync_jobs_history: int = 100  # finished sync jobs kept for the api
+    sync_auto_download: bool = False  # queue new tracks after a background sync
+    sync_lock_path: str = str(BASE_DIR / "sync_me.sync.lock")
+    soundcloud_concurrent_requests: int = 6  # parallel api-v2 requests per sync
+    soundcloud_request_retries: int = 3
+    soundcloud_credentials_ttl: int = 6 * 60 * 60  # seconds to reuse client_id
+    soundcloud_stream_json: bool = False  # parse `collection` items while downloading
+    # shared aiohttp client, connections are kept alive between syncs
+    http_pool_limit: int = 100  # max open connections in total
+    http_pool_limit_per_host: int = 16  # api-v2 and soundcloud.com each
+    http_keepalive_timeout: float = 60  # seconds an idle connection is kept
+    http_dns_cache_ttl: int = 300  # seconds to cache resolved hosts
+    http_session_close_delay: float = 60  # grace period of a replaced session
     stream_chunk_size: int = 1024 * 1024  # 1 MB in bytes
+    stream_zero_copy: bool = True  # use zerocopysend/pathsend when server supports it
+    track_cache_size: int = 4096  # max tracks file metadata kept in memory
+    stream_cache_control: str = "private, no-cache"  # revalidated with ETag
+    page_size: int = 500  # default `limit` of list endpoints
+    max_page_size: int = 5000
     frontend_path: str = str(BASE_DIR / "static/frontend/")
+    frontend_cache_control: str = "no-cache"
+    # content hashed build outputs (e.g. assets/index-B1tQz3x8.js) never change
+    frontend_immutable_pattern: str = r"^assets/.+[.-][0-9A-Za-z_-]{8,}\.\w+$"
+    frontend_immutable_cache_control: str = "public, max-age=31536000, immutable"
 
     db_url: str = f"sqlite:///{DB_PATH}"
+    db_pool_size: int = 8
+    db_max_overflow: int = 8
+    # SQLite profile applied to every new connection
+    # readers don't block the downloads writer
+    sqlite_journal_mode: Literal[
+        "DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"
+    ] = "WAL"
+    # safe with WAL, fsync only on checkpoint
+    sqlite_synchronous: Literal["OFF", "NORMAL", "FULL", "EXTRA"] = "NORMAL"
+    sqlite_mmap_size: int = 256 * 1024 * 1024  # 256 MB in bytes
+    sqlite_cache_size: int = -64 * 1024  # negative value is in KiB, 64 MB
+    sqlite_busy_timeout: int = 5000  # ms to wait on a locked database
 
     @property
     def log_file(self) -> str:
         logs_file: str = str(Path(self.logs_path) / f"{self.service_name.lower()}.logs")
         return logs_file
 
+    @property
+    def async_db_url(self) -> str:
+        # same database through the asyncio driver
+        if self.db_url.startswith("sqlite://"):
+            return self.db_url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+        return self.db_url
+
     @property
     def output_download(self) -> str:
         return str(Path(self.download_folder) / self.file_template)
@@ -1,19 +1,130 @@
-from sqlmodel import Session, create_engine, SQLModel
+from sqlalchemy import Connection, Engine, event, func, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import delete, select, update, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.core.config import settings
+from app.core.logging import get_logger
+from app.models.playlist import (
+    DownloadJobModel,
+    DownloadStatusEnum,
+    DownloadTrackModel,
+    PlaylistTrackLinkModel,
+    TrackModel,
+)
 from typing import Annotated
 from fastapi import Depends
 
+logger = get_logger(__name__)
+
 connect_args = {"check_same_thread": False}
-engine = create_engine(settings.db_url, connect_args=connect_args)
+pool_args = {
+    "pool_size": settings.db_pool_size,
+    "max_overflow": settings.db_max_overflow,
+}
+async_engine = create_async_engine(
+    settings.async_db_url, connect_args=connect_args, **pool_args
+)
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+    cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+    cursor.execute(f"PRAGMA mmap_size={settings.sqlite_mmap_size:d}")
+    cursor.execute(f"PRAGMA cache_size={settings.sqlite_cache_size:d}")
+    cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout:d}")
+    cursor.close()
+
+
+def apply_sqlite_profile(sync_engine: Engine):
+    if sync_engine.dialect.name == "sqlite":
+        event.listen(sync_engine, "connect", set_sqlite_pragmas)
+
+
+apply_sqlite_profile(async_engine.sync_engine)
 
 
-def get_session():
-    with Session(engine) as session:
+def new_async_session() -> AsyncSession:
+    # objects stay usable after commit, lazy refresh isn't possible on async
+    return AsyncSession(async_engine, expire_on_commit=False)
+
+
+async def get_async_session():
+    async with new_async_session() as session:
         yield session
 
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+def merge_duplicate_tracks(conn: Connection):
+    """Merge the tracks sharing a `platform_id`, which syncs could create
+    before it was unique, into the one with the best download. Playlists are
+    linked to the kept track and the other downloads are removed."""
+    platform_ids = conn.execute(
+        select(TrackModel.platform_id)
+        .group_by(TrackModel.platform_id)
+        .having(func.count() > 1)
+    ).scalars()
+    for platform_id in platform_ids.all():
+        rows = conn.execute(
+            select(TrackModel.id, DownloadTrackModel.id, DownloadTrackModel.status)
+            .outerjoin(DownloadTrackModel, DownloadTrackModel.track_id == TrackModel.id)  # type: ignore
+            .where(TrackModel.platform_id == platform_id)
+        ).all()
+        # a finished download first, then any download, then the oldest track
+        keep_id, keep_download_id, _ = min(
+            rows,
+            key=lambda row: (
+                row[2] != DownloadStatusEnum.SUCCESSFUL,
+                row[1] is None,
+                row[0],
+            ),
+        )
+        track_ids = [row[0] for row in rows if row[0] != keep_id]
+        download_ids = [
+            row[1] for row in rows if row[1] is not None and row[1] != keep_download_id
+        ]
+        logger.warning(
+            "merge duplicate tracks %s of %s into %d", track_ids, platform_id, keep_id
+        )
+        # a playlist already linked to the kept track keeps a single link
+        conn.execute(
+            update(PlaylistTrackLinkModel)
+            .where(PlaylistTrackLinkModel.track_id.in_(track_ids))  # type: ignore
+            .values(track_id=keep_id)
+            .prefix_with("OR IGNORE")
+        )
+        conn.execute(
+            delete(PlaylistTrackLinkModel).where(
+                PlaylistTrackLinkModel.track_id.in_(track_ids)  # type: ignore
+            )
+        )
+        conn.execute(
+            delete(DownloadJobModel).where(
+                DownloadJobModel.download_id.in_(download_ids)  # type: ignore
+            )
+        )
+        conn.execute(
+            delete(DownloadTrackModel).where(
+                DownloadTrackModel.id.in_(download_ids)  # type: ignore
+            )
+        )
+        conn.execute(delete(TrackModel).where(TrackModel.id.in_(track_ids)))  # type: ignore
+
+
+def create_missing_indexes(conn: Connection):
+    # create_all only creates the indexes of tables it creates, a failing one
+    # stops the startup, the queries rely on them
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+async def create_db_and_tables():
+    async with async_engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.run_sync(merge_duplicate_tracks)
+        # replaced by trackmodel_platform_id_unique
+        await conn.execute(text("DROP INDEX IF EXISTS ix_trackmodel_platform_id"))
+        await conn.run_sync(create_missing_indexes)
 
 
-SessionDep = Annotated[Session, Depends(get_session)]
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_session)]
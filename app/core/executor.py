@@ -0,0 +1,69 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import anyio.to_thread
+
+
+def default_max_workers() -> int:
+    # same default as ThreadPoolExecutor
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+class MeteredThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor counting its queued and running calls"""
+
+    def __init__(self, max_workers: int | None = None, thread_name_prefix: str = ""):
+        self.max_workers = max_workers or default_max_workers()
+        super().__init__(self.max_workers, thread_name_prefix)
+        self.queued = 0
+        self.running = 0
+        self._stats_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        def run():
+            with self._stats_lock:
+                self.queued -= 1
+                self.running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._stats_lock:
+                    self.running -= 1
+
+        def on_done(future: Future):
+            # canceled before a thread picked it up
+            if future.cancelled():
+                with self._stats_lock:
+                    self.queued -= 1
+
+        with self._stats_lock:
+            self.queued += 1
+        try:
+            future = super().submit(run)
+        except BaseException:
+            # e.g. shut down, the call never gets queued
+            with self._stats_lock:
+                self.queued -= 1
+            raise
+        future.add_done_callback(on_done)
+        return future
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "max_workers": self.max_workers,
+                "running": self.running,
+                "queued": self.queued,
+                "saturation": self.running / self.max_workers,
+            }
+
+
+def starlette_threads_stats() -> dict:
+    """anyio worker threads, used by Starlette for sync routes and files"""
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    return {
+        "max_workers": limiter.total_tokens,
+        "running": limiter.borrowed_tokens,
+        "saturation": limiter.borrowed_tokens / limiter.total_tokens,
+    }
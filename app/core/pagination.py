@@ -0,0 +1,83 @@
+from collections.abc import Sequence
+from typing import Annotated, Any
+
+from fastapi import HTTPException, Query, Request, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import Select, select
+from sqlmodel import SQLModel
+from sqlmodel.sql.expression import SelectOfScalar
+
+from app.core.config import settings
+
+LimitQuery = Annotated[
+    int, Query(ge=1, le=settings.max_page_size, description="Max items per page")
+]
+CursorQuery = Annotated[
+    int | None, Query(description="`X-Next-Cursor` of the previous page")
+]
+FieldsQuery = Annotated[
+    str | None, Query(description="Comma separated fields to return, e.g. `id,name`")
+]
+
+
+def parse_fields(
+    fields: str | None, model: type[SQLModel], computed: Sequence[str] = ()
+) -> list[str] | None:
+    """Validate a `fields=` projection against the columns of `model`.
+
+    `id` is always part of the projection, it is the pagination key.
+    """
+    if not fields:
+        return None
+    allowed = set(model.model_fields) | set(computed)
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown Fields {', '.join(unknown)}",
+        )
+    return ["id"] + [field for field in dict.fromkeys(requested) if field != "id"]
+
+
+def projection_statement(model: type[SQLModel], projection: list[str]) -> Select:
+    # plain SQLAlchemy select so a single column still yields rows, not scalars
+    columns = [
+        getattr(model, field) for field in projection if field in model.model_fields
+    ]
+    return select(*columns)
+
+
+def projection_response(
+    rows: list[dict[str, Any]], headers: dict[str, str]
+) -> JSONResponse:
+    # partial items can't go through the endpoint `response_model`
+    return JSONResponse(jsonable_encoder(rows), headers=headers)
+
+
+def keyset_page(
+    statement: SelectOfScalar | Select, id_column: Any, cursor: int | None, limit: int
+) -> SelectOfScalar | Select:
+    """Restrict `statement` to the page after `cursor`, one extra row is
+    fetched to know whether another page exists"""
+    if cursor is not None:
+        statement = statement.where(id_column > cursor)
+    return statement.order_by(id_column).limit(limit + 1)
+
+
+def split_page(rows: Sequence, limit: int) -> tuple[list, int | None]:
+    if len(rows) <= limit:
+        return list(rows), None
+    page = list(rows[:limit])
+    return page, page[-1].id
+
+
+def page_headers(request: Request, next_cursor: int | None) -> dict[str, str]:
+    if next_cursor is None:
+        return {}
+    next_url = request.url.include_query_params(cursor=next_cursor)
+    return {
+        "X-Next-Cursor": str(next_cursor),
+        "Link": f'<{next_url}>; rel="next"',
+    }
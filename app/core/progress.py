@@ -0,0 +1,201 @@
+import asyncio
+import json
+import threading
+from collections.abc import Callable, Iterable, Iterator, Mapping, MutableMapping
+from contextlib import contextmanager, suppress
+from typing import Any
+
+from fastapi.encoders import jsonable_encoder
+
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# key of an entry in the messages of a subscriber from its source key and
+# value, None leaves the entry out
+EntryKey = Callable[[Any, Any], Any]
+# true for a source entry that won't change anymore
+EntryExpired = Callable[[Any, Any], bool]
+REMOVED = object()
+
+
+class ProgressSubscriber:
+    """SSE messages of one client, a JSON object of the changed entries per
+    message or a `snapshot` event with all of them"""
+
+    def __init__(self, hub: "ProgressHub", key: EntryKey | None, maxsize: int):
+        self.hub = hub
+        self.key = key
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize)
+
+    def send(self, message: str):
+        if self.queue.full():
+            # a slow client gets the whole state instead of the deltas it
+            # didn't read yet
+            logger.info("progress subscriber is behind, resync")
+            self.resync()
+            return
+        self.queue.put_nowait(message)
+
+    def resync(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        snapshot = self.hub.render(self.hub.entries, self.key) or "{}"
+        self.queue.put_nowait(f"event: snapshot\ndata: {snapshot}\n\n")
+
+    async def get(self) -> str:
+        return await self.queue.get()
+
+
+class ProgressHub:
+    """Broadcasts the changes of `source` to SSE subscribers.
+
+    Producers call `notify` with the keys they changed, at most once every
+    `interval` seconds only those entries are encoded and the ones that
+    differ from the previous tick are sent to every subscriber, removed
+    entries as null. A subscriber starts with a `snapshot` event of all the
+    entries, which replaces what the client has. Each subscriber has its own
+    queue of `queue_size` messages, so a slow client doesn't hold the others.
+
+    With `expired`, entries that won't change anymore are removed from
+    `source` once broadcast, so it doesn't grow with every finished item.
+    """
+
+    def __init__(
+        self,
+        source: Mapping | MutableMapping,
+        interval: float = 0.5,
+        queue_size: int = 16,
+        expired: EntryExpired | None = None,
+    ) -> None:
+        self.source = source
+        self.interval = interval
+        self.queue_size = queue_size
+        self.expired = expired
+        self.subscribers: set[ProgressSubscriber] = set()
+        # source key -> (value, encoded value) as last broadcast
+        self.entries: dict[Any, tuple[Any, str]] = {}
+        # keys notified since the last refresh, None for all of them
+        self.changed_keys: set | None = None
+        self.changed_keys_lock = threading.Lock()
+        # refreshed entries that expired, removed once broadcast
+        self.expired_entries: dict[Any, Any] = {}
+        self.changed = asyncio.Event()
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.task: asyncio.Task | None = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.loop = asyncio.get_running_loop()
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+
+    def notify(self, *keys):
+        """Mark `keys` of `source` as changed, every key if none is given,
+        safe to call from the download threads"""
+        with self.changed_keys_lock:
+            if not keys:
+                self.changed_keys = None
+            elif self.changed_keys is not None:
+                self.changed_keys.update(keys)
+        if self.loop is None or self.loop.is_closed():
+            # not started yet, the changed keys are refreshed once it is
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self.changed.set()
+        else:
+            self.loop.call_soon_threadsafe(self.changed.set)
+
+    async def run(self):
+        while True:
+            await self.changed.wait()
+            self.changed.clear()
+            self.publish()
+            # progress of a whole tick goes out in one message
+            await asyncio.sleep(self.interval)
+
+    def take_changed_keys(self) -> set | None:
+        with self.changed_keys_lock:
+            keys, self.changed_keys = self.changed_keys, set()
+        return keys
+
+    def refresh(self, keys: Iterable | None = None) -> dict[Any, tuple[Any, str]]:
+        """Encode the entries of `source` in `keys`, all of them if None,
+        returns the changed ones"""
+        if keys is None:
+            keys = dict(self.source).keys() | self.entries.keys()
+        changes = {}
+        for key in keys:
+            value = self.source.get(key, REMOVED)
+            if value is REMOVED:
+                if key in self.entries:
+                    value, _ = self.entries.pop(key)
+                    changes[key] = (value, "null")
+                continue
+            # checked first, the producers may still change the value while
+            # it's encoded
+            if self.expired and self.expired(key, value):
+                self.expired_entries[key] = value
+            encoded = json.dumps(jsonable_encoder(value))
+            previous = self.entries.get(key)
+            if previous is None or previous[1] != encoded:
+                changes[key] = self.entries[key] = (value, encoded)
+        return changes
+
+    def publish(self):
+        changes = self.refresh(self.take_changed_keys())
+        self.broadcast(changes)
+        for key, value in self.expired_entries.items():
+            self.entries.pop(key, None)
+            # unless a producer replaced it in the meantime
+            if self.source.get(key) is value:
+                del self.source[key]  # type: ignore
+        self.expired_entries.clear()
+
+    def render(
+        self, entries: Mapping[Any, tuple[Any, str]], key: EntryKey | None = None
+    ) -> str | None:
+        parts = []
+        for source_key, (value, encoded) in entries.items():
+            output_key = source_key if key is None else key(source_key, value)
+            if output_key is not None:
+                parts.append(f"{json.dumps(str(output_key))}:{encoded}")
+        return "{" + ",".join(parts) + "}" if parts else None
+
+    def broadcast(self, changes: dict[Any, tuple[Any, str]]):
+        if not changes:
+            return
+        # subscribers of every entry share one message
+        shared = None
+        for subscriber in self.subscribers:
+            if subscriber.key is None:
+                shared = shared or self.render(changes)
+                data = shared
+            else:
+                data = self.render(changes, subscriber.key)
+            if data:
+                subscriber.send(f"data: {data}\n\n")
+
+    @contextmanager
+    def subscribe(self, key: EntryKey | None = None) -> Iterator[ProgressSubscriber]:
+        self.start()
+        # changes not sent yet go to the current subscribers first, the new
+        # one gets them within its snapshot
+        self.publish()
+        subscriber = ProgressSubscriber(self, key, self.queue_size)
+        subscriber.resync()
+        self.subscribers.add(subscriber)
+        try:
+            yield subscriber
+        finally:
+            self.subscribers.discard(subscriber)
@@ -0,0 +1,155 @@
+import re
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+THROTTLED_STATUS = 429
+# message of a yt-dlp HTTPError, a download process only sends the text back
+THROTTLED_MESSAGE = re.compile(rf"\bHTTP Error {THROTTLED_STATUS}\b")
+
+
+def error_chain(error: BaseException | None) -> Iterator[BaseException]:
+    """`error` and the errors behind it, yt-dlp keeps the original one in
+    `exc_info` or `cause` rather than chaining it"""
+    pending = [error]
+    seen = set()
+    while pending:
+        error = pending.pop()
+        if not isinstance(error, BaseException) or id(error) in seen:
+            continue
+        seen.add(id(error))
+        yield error
+        exc_info = getattr(error, "exc_info", None)
+        if isinstance(exc_info, tuple) and len(exc_info) == 3:
+            pending.append(exc_info[1])
+        pending += [getattr(error, "cause", None), error.__cause__, error.__context__]
+
+
+def is_throttled(error: BaseException | None) -> bool:
+    for cause in error_chain(error):
+        status = getattr(cause, "status", None) or getattr(cause, "code", None)
+        if status == THROTTLED_STATUS or THROTTLED_MESSAGE.search(str(cause)):
+            return True
+    return False
+
+
+@dataclass
+class StatsWindow:
+    downloaded_bytes: int
+    attempts: int
+    failures: int
+    throttled: int
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        return self.downloaded_bytes / self.seconds if self.seconds else 0
+
+    @property
+    def error_rate(self) -> float:
+        return self.failures / self.attempts if self.attempts else 0
+
+
+class DownloadStats:
+    """Downloaded bytes and attempt results since the last `take`, fed by the
+    progress hooks from the download threads"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._last_bytes: dict[int, int] = {}
+        self._reset()
+
+    def _reset(self):
+        self.downloaded_bytes = 0
+        self.attempts = 0
+        self.failures = 0
+        self.throttled = 0
+        self.started_at = time.monotonic()
+
+    def add_progress(self, download_id: int, downloaded_bytes: int):
+        with self._lock:
+            previous = self._last_bytes.get(download_id, 0)
+            if downloaded_bytes > previous:
+                self.downloaded_bytes += downloaded_bytes - previous
+            self._last_bytes[download_id] = downloaded_bytes
+
+    def add_result(self, download_id: int, error: BaseException | None):
+        with self._lock:
+            self._last_bytes.pop(download_id, None)
+            self.attempts += 1
+            if error is not None:
+                self.failures += 1
+            if is_throttled(error):
+                self.throttled += 1
+
+    def take(self) -> StatsWindow:
+        with self._lock:
+            window = StatsWindow(
+                self.downloaded_bytes,
+                self.attempts,
+                self.failures,
+                self.throttled,
+                time.monotonic() - self.started_at,
+            )
+            self._reset()
+        return window
+
+
+class AimdController:
+    """Additive-increase/multiplicative-decrease of the download workers.
+
+    A throttled attempt or an error rate above `max_error_rate` divides the
+    limit by `1 / decrease`. Otherwise, when every worker is busy, the limit
+    grows by one as long as the previous increase raised the throughput by
+    `min_gain`, after an increase that didn't, the limit is held for a
+    window before probing again.
+    """
+
+    def __init__(
+        self,
+        min_limit: int,
+        max_limit: int,
+        decrease: float,
+        max_error_rate: float,
+        min_gain: float,
+    ) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.max_error_rate = max_error_rate
+        self.min_gain = min_gain
+        self.last_throughput: float | None = None
+        self.increased = False
+
+    def next_limit(self, limit: int, window: StatsWindow, saturated: bool) -> int:
+        increased, self.increased = self.increased, False
+        last_throughput, self.last_throughput = self.last_throughput, window.throughput
+
+        if window.throttled or window.error_rate > self.max_error_rate:
+            new_limit = max(self.min_limit, int(limit * self.decrease))
+            logger.info(
+                "autotune decrease %d to %d throttled %d error rate %.2f",
+                limit,
+                new_limit,
+                window.throttled,
+                window.error_rate,
+            )
+            return new_limit
+        if not saturated or limit >= self.max_limit:
+            # idle workers, more of them wouldn't download faster
+            return max(self.min_limit, min(limit, self.max_limit))
+        if (
+            increased
+            and last_throughput is not None
+            and window.throughput < last_throughput * (1 + self.min_gain)
+        ):
+            logger.info("autotune hold %d throughput %d B/s", limit, window.throughput)
+            return limit
+        self.increased = True
+        logger.info("autotune increase %d throughput %d B/s", limit, window.throughput)
+        return limit + 1
@@ -0,0 +1,97 @@
+import asyncio
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+from app.core import config
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# sets the yt-dlp `ratelimit` of a running download, None is unlimited
+ApplyRateLimit = Callable[[int | None], None]
+
+
+class BandwidthBudget:
+    """Splits `download_bandwidth_limit` evenly between the running downloads
+    as yt-dlp `ratelimit`s, capped by `download_job_bandwidth_limit`.
+
+    The shares are applied again whenever a download starts or ends. While
+    /player streams are active, and `download_stream_linger` seconds after
+    the last one since players fetch ranges in bursts,
+    `download_stream_reserve` of the budget is left to them.
+    """
+
+    def __init__(self) -> None:
+        self.jobs: list[ApplyRateLimit] = []
+        self.streams = 0
+        self.last_stream_at = 0.0
+        self._linger: asyncio.TimerHandle | None = None
+
+    @property
+    def is_streaming(self) -> bool:
+        linger = config.settings.download_stream_linger
+        return self.streams > 0 or time.monotonic() - self.last_stream_at < linger
+
+    def budget(self) -> int | None:
+        total = config.settings.download_bandwidth_limit
+        if not total:
+            return None
+        if self.is_streaming:
+            return int(total * (1 - config.settings.download_stream_reserve))
+        return total
+
+    def job_limit(self) -> int | None:
+        limits = [config.settings.download_job_bandwidth_limit or None]
+        budget = self.budget()
+        if budget is not None:
+            limits.append(budget // max(1, len(self.jobs)))
+        limits = [limit for limit in limits if limit is not None]
+        # yt-dlp divides by the limit
+        return max(1, min(limits)) if limits else None
+
+    def rebalance(self):
+        limit = self.job_limit()
+        for apply in self.jobs:
+            try:
+                apply(limit)
+            except OSError as err:
+                # the pipe of a download process that just died
+                logger.error("can't apply download rate limit: %s", err)
+
+    @contextmanager
+    def job(self, apply: ApplyRateLimit) -> Iterator[None]:
+        self.jobs.append(apply)
+        self.rebalance()
+        try:
+            yield
+        finally:
+            self.jobs.remove(apply)
+            self.rebalance()
+
+    @contextmanager
+    def stream(self) -> Iterator[None]:
+        was_streaming = self.is_streaming
+        self.streams += 1
+        if not was_streaming:
+            logger.info("player streaming, download budget %s", self.budget())
+            self.rebalance()
+        try:
+            yield
+        finally:
+            self.streams -= 1
+            self.last_stream_at = time.monotonic()
+            self._schedule_linger_end()
+
+    def _schedule_linger_end(self):
+        if self._linger:
+            self._linger.cancel()
+        self._linger = asyncio.get_running_loop().call_later(
+            config.settings.download_stream_linger, self._linger_end
+        )
+
+    def _linger_end(self):
+        self._linger = None
+        if not self.is_streaming:
+            logger.info("player idle, download budget %s", self.budget())
+            self.rebalance()
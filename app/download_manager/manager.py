@@ -1,22 +1,57 @@
-from asyncio import Queue, Condition
 import asyncio
+from collections import Counter
+from collections.abc import Awaitable, Callable
+from concurrent.futures import Executor
 from dataclasses import dataclass
+from datetime import datetime, timedelta
+import os
+import socket
 import threading
-from types import CoroutineType
+from uuid import uuid4
 
+from sqlalchemy import literal
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import delete, or_, select, update
+from app.core import config
+from app.core.db import new_async_session
+from app.core.executor import MeteredThreadPoolExecutor
 from app.core.logging import get_logger
-from app.models.playlist import DownloadStatusEnum, DownloadTrackModel
+from app.core.progress import ProgressHub
+from app.download_manager.autotune import AimdController, DownloadStats
+from app.download_manager.bandwidth import BandwidthBudget
+from app.models.playlist import (
+    DownloadJobModel,
+    DownloadStatusEnum,
+    DownloadTrackModel,
+)
 from pydantic import BaseModel, ConfigDict
 logger = get_logger(__name__)
 
+# lower runs first
+HIGH_PRIORITY = 0  # requested by the user, e.g. a single track or a retry
+NORMAL_PRIORITY = 5  # resumed after a restart
+LOW_PRIORITY = 10  # bulk backfill of playlists
+
+# 6 columns per job, far below SQLite's 32766 variables per statement
+PUT_BATCH_SIZE = 1000
+
 
 @dataclass
 class DownloadContext:
     progress_reports: dict
     cancel_event: threading.Event
-    progress_event: asyncio.Event
-    download_object: DownloadTrackModel
+    progress_hub: ProgressHub
+    download_id: int
+    download_object: DownloadTrackModel | None = None
     file_path: str | None = None
+    attempt: int = 1
+    # set by a failed attempt that the queue runs again later
+    retry: bool = False
+    # runs the blocking download calls, the default executor if None
+    executor: Executor | None = None
+    stats: DownloadStats | None = None
+    bandwidth: BandwidthBudget | None = None
+    error: Exception | None = None  # of a failed attempt
 
 
 class DownloadProgressReport(BaseModel):
@@ -26,76 +61,427 @@ class DownloadProgressReport(BaseModel):
     status: DownloadStatusEnum = DownloadStatusEnum.DOWNLOADING
 
 
-class AdjustableSemaphore:
-    def __init__(self, total_limit: int) -> None:
-        self.total_limit = total_limit
-        self.total_tasks = 0
-        self._condition = Condition()
+def is_report_final(_, report: DownloadProgressReport) -> bool:
+    return report.status in (DownloadStatusEnum.SUCCESSFUL, DownloadStatusEnum.FAILED)
+
+
+class DownloadQueue:
+    """Download jobs persisted in `DownloadJobModel`, lower `priority` first
+    then FIFO.
+
+    A waiting job gains one priority level every `aging_interval` seconds so
+    backfills aren't starved, `rank` is `priority + enqueued_at /
+    aging_interval` which is fixed once queued. A job is claimed with a
+    single UPDATE, so workers of several processes never run the same
+    download, and holds a lease renewed while it runs. The job of a process
+    that died is claimed again once its lease expires.
+    """
+
+    def __init__(self, aging_interval: float, lease_duration: float) -> None:
+        self.aging_interval = aging_interval
+        self.lease_duration = lease_duration
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+    def rank(self, priority: int, enqueued_at: datetime) -> float:
+        return priority + enqueued_at.timestamp() / self.aging_interval
+
+    def is_unleased(self, now: datetime):
+        return or_(
+            DownloadJobModel.lease_expires_at.is_(None),  # type: ignore
+            DownloadJobModel.lease_expires_at < now,  # type: ignore
+        )
+
+    async def put(self, download_ids: list[int], priority: int):
+        """Queue the downloads, a queued one is moved to `priority` with its
+        attempts reset and a running one is left alone"""
+        now = datetime.now()
+        async with new_async_session() as orm:
+            for i in range(0, len(download_ids), PUT_BATCH_SIZE):
+                statement = sqlite_insert(DownloadJobModel).values(
+                    [
+                        {
+                            "download_id": download_id,
+                            "priority": priority,
+                            "rank": self.rank(priority, now),
+                            "attempts": 0,
+                            "next_run_at": now,
+                            "enqueued_at": now,
+                        }
+                        for download_id in download_ids[i : i + PUT_BATCH_SIZE]
+                    ]
+                )
+                statement = statement.on_conflict_do_update(
+                    index_elements=[DownloadJobModel.download_id],
+                    set_={
+                        "priority": statement.excluded.priority,
+                        "rank": statement.excluded.rank,
+                        "attempts": 0,
+                        "next_run_at": statement.excluded.next_run_at,
+                        "enqueued_at": statement.excluded.enqueued_at,
+                    },
+                    where=self.is_unleased(now),
+                )
+                await orm.exec(statement)  # type: ignore
+            await orm.commit()
+
+    async def recover(self) -> int:
+        """Queue pending downloads that have no job, e.g. of a database from
+        before the queue was persisted, and reset the status of downloads
+        interrupted by a crash"""
+        now = datetime.now()
+        unqueued = select(
+            DownloadTrackModel.id,
+            literal(NORMAL_PRIORITY),
+            literal(self.rank(NORMAL_PRIORITY, now)),
+            literal(0),
+            literal(now),
+            literal(now),
+        ).where(
+            DownloadTrackModel.status.in_(  # type: ignore
+                [DownloadStatusEnum.PENDING, DownloadStatusEnum.DOWNLOADING]
+            )
+        )
+        insert_statement = (
+            sqlite_insert(DownloadJobModel)
+            .from_select(
+                [
+                    "download_id",
+                    "priority",
+                    "rank",
+                    "attempts",
+                    "next_run_at",
+                    "enqueued_at",
+                ],
+                unqueued,
+            )
+            .on_conflict_do_nothing()
+        )
+        running = select(DownloadJobModel.download_id).where(
+            DownloadJobModel.lease_expires_at >= now  # type: ignore
+        )
+        reset_statement = (
+            update(DownloadTrackModel)
+            .where(DownloadTrackModel.status == DownloadStatusEnum.DOWNLOADING)  # type: ignore
+            .where(DownloadTrackModel.id.not_in(running))  # type: ignore
+            .values(status=DownloadStatusEnum.PENDING)
+        )
+        async with new_async_session() as orm:
+            result = await orm.exec(insert_statement)  # type: ignore
+            await orm.exec(reset_statement)  # type: ignore
+            await orm.commit()
+        return result.rowcount
+
+    def ready_jobs(self, now: datetime):
+        return (
+            select(DownloadJobModel.id)
+            .where(DownloadJobModel.next_run_at <= now)
+            .where(self.is_unleased(now))
+        )
+
+    async def has_ready_jobs(self) -> bool:
+        async with new_async_session() as orm:
+            job = (await orm.exec(self.ready_jobs(datetime.now()).limit(1))).first()
+        return job is not None
 
-    async def acquire(self):
-        async with self._condition:
-            while self.total_tasks >= self.total_limit:
-                await self._condition.wait()
-            self.total_tasks += 1
+    async def claim(self) -> DownloadJobModel | None:
+        now = datetime.now()
+        next_job = (
+            self.ready_jobs(now)
+            .order_by(DownloadJobModel.rank, DownloadJobModel.id)  # type: ignore
+            .limit(1)
+            .scalar_subquery()
+        )
+        statement = (
+            update(DownloadJobModel)
+            .where(DownloadJobModel.id == next_job)  # type: ignore
+            .values(
+                lease_owner=self.owner,
+                lease_expires_at=now + timedelta(seconds=self.lease_duration),
+                attempts=DownloadJobModel.attempts + 1,
+            )
+            .returning(DownloadJobModel)
+        )
+        async with new_async_session() as orm:
+            job = (await orm.exec(statement)).scalar_one_or_none()  # type: ignore
+            await orm.commit()
+        return job
+
+    async def _update_leased(self, job: DownloadJobModel, **values) -> bool:
+        statement = (
+            update(DownloadJobModel)
+            .where(DownloadJobModel.id == job.id)  # type: ignore
+            .where(DownloadJobModel.lease_owner == self.owner)  # type: ignore
+            .values(**values)
+        )
+        async with new_async_session() as orm:
+            result = await orm.exec(statement)  # type: ignore
+            await orm.commit()
+        return result.rowcount > 0
+
+    async def renew(self, job: DownloadJobModel) -> bool:
+        expires_at = datetime.now() + timedelta(seconds=self.lease_duration)
+        return await self._update_leased(job, lease_expires_at=expires_at)
+
+    async def retry(self, job: DownloadJobModel, delay: float) -> bool:
+        next_run_at = datetime.now() + timedelta(seconds=delay)
+        return await self._update_leased(
+            job, lease_owner=None, lease_expires_at=None, next_run_at=next_run_at
+        )
+
+    async def release(self, job: DownloadJobModel) -> bool:
+        """Give back a job interrupted by a shutdown, the attempt isn't
+        counted"""
+        released = await self._update_leased(
+            job,
+            lease_owner=None,
+            lease_expires_at=None,
+            attempts=DownloadJobModel.attempts - 1,
+        )
+        if released:
+            statement = (
+                update(DownloadTrackModel)
+                .where(DownloadTrackModel.id == job.download_id)  # type: ignore
+                .values(status=DownloadStatusEnum.PENDING)
+            )
+            async with new_async_session() as orm:
+                await orm.exec(statement)  # type: ignore
+                await orm.commit()
+        return released
 
-    async def release(self):
-        async with self._condition:
-            self.total_tasks -= 1
-            self._condition.notify_all()
+    async def finish(self, job: DownloadJobModel):
+        statement = (
+            delete(DownloadJobModel)
+            .where(DownloadJobModel.id == job.id)  # type: ignore
+            .where(DownloadJobModel.lease_owner == self.owner)  # type: ignore
+        )
+        async with new_async_session() as orm:
+            await orm.exec(statement)  # type: ignore
+            await orm.commit()
 
-    async def update_limit(self, new_limit):
-        async with self._condition:
-            logger.info(
-                "update semaphore limit from %d to %d", self.total_limit, new_limit
+    async def reprioritize(self, download_id: int, priority: int) -> bool:
+        now = datetime.now()
+        statement = (
+            update(DownloadJobModel)
+            .where(DownloadJobModel.download_id == download_id)  # type: ignore
+            .where(self.is_unleased(now))
+            # keeps `enqueued_at`, the time already waited still counts
+            .values(
+                rank=DownloadJobModel.rank - DownloadJobModel.priority + priority,
+                priority=priority,
             )
-            self.total_limit = new_limit
-            self._condition.notify_all()
+        )
+        async with new_async_session() as orm:
+            result = await orm.exec(statement)  # type: ignore
+            await orm.commit()
+        return result.rowcount > 0
+
+    async def remove(self, download_id: int) -> bool:
+        statement = delete(DownloadJobModel).where(
+            DownloadJobModel.download_id == download_id  # type: ignore
+        )
+        async with new_async_session() as orm:
+            result = await orm.exec(statement)  # type: ignore
+            await orm.commit()
+        return result.rowcount > 0
 
 
 class DownloadManager:
-    def __init__(self, total_concurrent_downloads: int) -> None:
-        self.semaphore = AdjustableSemaphore(total_concurrent_downloads)
-        self.queue = Queue()
+    """Fixed pool of `pool_size` workers claiming jobs from the queue.
+
+    A worker claims the next job only once it's free, only running downloads
+    are held in memory. `resize` applies a new `concurrent_downloads` live,
+    surplus busy workers stop after their current download.
+
+    Blocking download calls run on `executor`, sized with the pool, so they
+    can't take the threads of the default executor. With `download_autotune`
+    the pool size is adjusted by an `AimdController` from `stats`.
+    """
+
+    def __init__(
+        self,
+        total_concurrent_downloads: int,
+        download: Callable[[DownloadContext], Awaitable[None]],
+    ) -> None:
+        self.pool_size = total_concurrent_downloads
+        self.download = download
+        self.workers: set[asyncio.Task] = set()
+        self.idle_workers: set[asyncio.Task] = set()
+        self.executor = self.create_executor(total_concurrent_downloads)
+        # running jobs per executor, a resized one is shut down once its
+        # jobs are done since they hold it for all of their calls
+        self.executor_jobs: Counter[MeteredThreadPoolExecutor] = Counter()
+        self.stats = DownloadStats()
+        self.bandwidth = BandwidthBudget()
+        self.autotune_task: asyncio.Task | None = None
+        self.queue = DownloadQueue(
+            config.settings.download_priority_aging,
+            config.settings.download_lease_duration,
+        )
+        # set when jobs are queued, idle workers also poll for jobs of other
+        # processes and retries that became due
+        self.wakeup = asyncio.Event()
+        self.stopping = False
         self.tasks: dict[int, tuple[asyncio.Task, threading.Event]] = {}
         self.progress_reports: dict[int, DownloadProgressReport] = {}
-        self.progress_event = asyncio.Event()
+        self.progress_hub = ProgressHub(self.progress_reports, expired=is_report_final)
+
+    def start(self):
+        # prunes the finished reports even if nobody listens
+        self.progress_hub.start()
+        self.resize(self.pool_size)
+        if config.settings.download_autotune:
+            self.autotune_task = asyncio.create_task(self.autotune())
+
+    def create_executor(self, pool_size: int) -> MeteredThreadPoolExecutor:
+        return MeteredThreadPoolExecutor(max(1, pool_size), "download")
+
+    def resize(self, pool_size: int):
+        logger.info("resize download workers from %d to %d", self.pool_size, pool_size)
+        self.pool_size = pool_size
+        if max(1, pool_size) != self.executor.max_workers:
+            previous, self.executor = self.executor, self.create_executor(pool_size)
+            if not self.executor_jobs[previous]:
+                previous.shutdown(wait=False)
+        while len(self.workers) < pool_size:
+            worker = asyncio.create_task(self.worker())
+            worker.add_done_callback(self.workers.discard)
+            self.workers.add(worker)
+        # idle workers hold no job, they can go right away
+        surplus = list(self.idle_workers)[: max(0, len(self.workers) - pool_size)]
+        for worker in surplus:
+            self.workers.discard(worker)
+            self.idle_workers.discard(worker)
+            worker.cancel()
 
     async def worker(self):
-        while True:
-            (
-                download_id,
-                download_task,
-                cancel_event,
-                priority,
-            ) = await self.queue.get()
-            task = asyncio.create_task(
-                self.task_runner(
-                    download_task,
-                )
+        current = asyncio.current_task()
+        while not self.stopping and len(self.workers) <= self.pool_size:
+            try:
+                self.wakeup.clear()
+                job = await self.queue.claim()
+                if not job:
+                    await self.wait_for_jobs(current)  # type: ignore
+                    continue
+                # more jobs may be waiting for the other idle workers
+                self.wakeup.set()
+                if self.stopping:
+                    await self.queue.release(job)
+                    break
+                await self.run_job(job)
+            except Exception:
+                # e.g. a locked database, the worker must outlive it or the
+                # pool shrinks for good
+                logger.exception("download worker failed")
+                await self.wait_for_jobs(current)  # type: ignore
+        self.workers.discard(current)  # type: ignore
+
+    async def wait_for_jobs(self, worker: asyncio.Task):
+        self.idle_workers.add(worker)
+        try:
+            await asyncio.wait_for(
+                self.wakeup.wait(), config.settings.download_queue_poll_interval
             )
-            self.tasks[download_id] = (task, cancel_event)
+        except TimeoutError:
+            pass
+        finally:
+            self.idle_workers.discard(worker)
 
-    async def task_runner(self, task: asyncio.Task):
-        await self.semaphore.acquire()
+    async def run_job(self, job: DownloadJobModel):
+        executor = self.executor
+        self.executor_jobs[executor] += 1
+        ctx = DownloadContext(
+            progress_reports=self.progress_reports,
+            progress_hub=self.progress_hub,
+            cancel_event=threading.Event(),
+            download_id=job.download_id,
+            attempt=job.attempts,
+            executor=executor,
+            stats=self.stats,
+            bandwidth=self.bandwidth,
+        )
+        task = asyncio.create_task(self.download(ctx))
+        self.tasks[job.download_id] = (task, ctx.cancel_event)
+        renewal = self.queue.lease_duration / 3
         try:
-            await task
+            # a canceled download doesn't stop the worker
+            while not (await asyncio.wait([task], timeout=renewal))[0]:
+                try:
+                    await self.queue.renew(job)
+                except Exception:
+                    # the download goes on, the lease lasts a few renewals
+                    logger.exception("renew lease of download %d", job.download_id)
         finally:
-            await self.semaphore.release()
+            if self.tasks.get(job.download_id, (None,))[0] is task:
+                del self.tasks[job.download_id]
+            self.release_executor(executor)
 
-    async def add_to_queue(
-        self,
-        download_id: int,
-        download_task: CoroutineType,
-        cancel_event: threading.Event,
-        priority: int,
-    ):
-        await self.queue.put((download_id, download_task, cancel_event, priority))
+        if not task.cancelled() and task.exception():
+            logger.error("download %d failed: %r", job.download_id, task.exception())
+        if not task.cancelled() and not ctx.cancel_event.is_set():
+            self.stats.add_result(job.download_id, ctx.error or task.exception())
+        if self.stopping:
+            await self.queue.release(job)
+        elif ctx.retry:
+            delay = config.settings.download_retry_delay * 2 ** (job.attempts - 1)
+            logger.info("retry download %d in %d seconds", job.download_id, delay)
+            await self.queue.retry(job, delay)
+        else:
+            await self.queue.finish(job)
+
+    def release_executor(self, executor: MeteredThreadPoolExecutor):
+        self.executor_jobs[executor] -= 1
+        if self.executor_jobs[executor] <= 0:
+            del self.executor_jobs[executor]
+            if executor is not self.executor:
+                executor.shutdown(wait=False)
+
+    async def autotune(self):
+        controller = AimdController(
+            config.settings.download_autotune_min,
+            config.settings.download_autotune_max,
+            config.settings.download_autotune_decrease,
+            config.settings.download_autotune_error_rate,
+            config.settings.download_autotune_min_gain,
+        )
+        self.stats.take()
+        while True:
+            await asyncio.sleep(config.settings.download_autotune_interval)
+            # more workers only help when all are busy and jobs are waiting
+            saturated = (
+                len(self.tasks) >= self.pool_size and await self.queue.has_ready_jobs()
+            )
+            limit = controller.next_limit(self.pool_size, self.stats.take(), saturated)
+            if limit != self.pool_size:
+                self.resize(limit)
+
+    async def stop(self):
+        self.stopping = True
+        if self.autotune_task:
+            self.autotune_task.cancel()
+        for task, cancel_event in list(self.tasks.values()):
+            cancel_event.set()
+            task.cancel()
+        for worker in list(self.idle_workers):
+            worker.cancel()
+        # busy workers give their job back to the queue
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        for executor in {self.executor, *self.executor_jobs}:
+            executor.shutdown(wait=False, cancel_futures=True)
+        await self.progress_hub.stop()
+
+    async def add_to_queue(self, download_ids: list[int], priority: int):
+        await self.queue.put(download_ids, priority)
+        self.wakeup.set()
+
+    async def reprioritize(self, download_id: int, priority: int) -> bool:
+        logger.info("reprioritize %d to %d", download_id, priority)
+        return await self.queue.reprioritize(download_id, priority)
 
     async def cancel_download(self, download_id):
         logger.info("Start Canceling %d", download_id)
+        await self.queue.remove(download_id)
         task, cancel_event = self.tasks.get(download_id, (None, threading.Event()))
-        if not task:
-            return
-        cancel_event.set()
-        task.cancel()
+        if task:
+            cancel_event.set()
+            task.cancel()
         logger.info("Start Canceling %d Done", download_id)
@@ -1,13 +1,16 @@
 import asyncio
 from fastapi.routing import APIRouter
+from sqlalchemy.orm import selectinload
 from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.core import config
-from app.core.db import SessionDep
+from app.core.cache import track_file_cache
+from app.core.db import new_async_session
 from app.core.logging import get_logger
 from app.download_manager.manager import DownloadContext, DownloadProgressReport
-from app.models.playlist import DownloadStatusEnum
+from app.models.playlist import DownloadStatusEnum, DownloadTrackModel
 from app.models.settings import SettingsModel
-from app.soundcloud.download import sync_download_ytdl
+from app.soundcloud.download import download_ytdl
 
 router = APIRouter(prefix="/downloads")
 logger = get_logger(__name__)
@@ -33,16 +36,22 @@ def error_logger(fn):
 @error_logger
 def download_hook(dtl, ctx: DownloadContext):
     progress_reports: dict[int, DownloadProgressReport] = ctx.progress_reports
-    download_id = ctx.download_object.id or -1
+    download_id = ctx.download_id
 
     if ctx.cancel_event.is_set():
         logger.info("Downloading Thread Is Canceled")
         raise asyncio.CancelledError()
 
+    track_id = ctx.download_object.track_id if ctx.download_object else -1
+
+    downloaded_bytes = dtl.get("downloaded_bytes")
+    if ctx.stats and downloaded_bytes:
+        ctx.stats.add_progress(download_id, downloaded_bytes)
+
     percent = dtl.get("_percent", 0)
     current_report = progress_reports.get(
         download_id,
-        DownloadProgressReport(track_id=ctx.download_object.track_id),
+        DownloadProgressReport(track_id=track_id),
     )
     current_report.percent = max(current_report.percent, int(percent))
     current_report.status = YTDL_STATUS_MAP.get(
@@ -54,7 +63,7 @@ def download_hook(dtl, ctx: DownloadContext):
         ctx.file_path = dtl.get("filename")
         logger.info("File Path: %s", ctx.file_path)
 
-    ctx.progress_event.set()
+    ctx.progress_hub.notify(download_id)
     logger.info(f"*** Progress: {current_report.percent} {current_report.status}")
 
 
@@ -72,14 +81,32 @@ class YtdlLogger:
         logger.error(msg)
 
 
-async def download(ctx: DownloadContext, orm: SessionDep):
-    logger.info("Start Downloading %d", ctx.download_object.id)
-    ctx.download_object.status = DownloadStatusEnum.DOWNLOADING
-    orm.add(ctx.download_object)
-    orm.commit()
+async def download(ctx: DownloadContext):
+    # queued downloads outlive the request that created them, so they can't
+    # share its session
+    async with new_async_session() as orm:
+        await run_download(ctx, orm)
+
+
+async def run_download(ctx: DownloadContext, orm: AsyncSession):
+    logger.info("Start Downloading %d attempt %d", ctx.download_id, ctx.attempt)
+    download_query = (
+        select(DownloadTrackModel)
+        .where(DownloadTrackModel.id == ctx.download_id)
+        .options(selectinload(DownloadTrackModel.track))  # type: ignore
+    )
+    download_object = (await orm.exec(download_query)).one_or_none()
+    if not download_object:
+        logger.warning("Download %d Not Found", ctx.download_id)
+        return
+    ctx.download_object = download_object
+
+    download_object.status = DownloadStatusEnum.DOWNLOADING
+    orm.add(download_object)
+    await orm.commit()
 
     setting_query = select(SettingsModel)
-    setting = orm.exec(setting_query).one_or_none()
+    setting = (await orm.exec(setting_query)).one_or_none()
     concurrent_fragment_downloads = (
         setting.concurrent_fragment_downloads
         if setting
@@ -89,7 +116,6 @@ async def download(ctx: DownloadContext, orm: SessionDep):
     download_retries = (
         setting.download_retries if setting else config.settings.download_retries
     )
-    total_retry = 0
 
     try:
         ydl_config = config.ydl_opts.copy()
@@ -98,23 +124,11 @@ async def download(ctx: DownloadContext, orm: SessionDep):
         ydl_config["concurrent_fragment_downloads"] = concurrent_fragment_downloads
         ydl_config["proxy"] = http_proxy or None
 
-        is_successful = True
-        exception = None
-        while total_retry < download_retries:
-            is_successful, exception = await asyncio.create_task(
-                asyncio.to_thread(
-                    sync_download_ytdl,
-                    [ctx.download_object.track.url or ""],
-                    ydl_config,
-                )
-            )
-            if is_successful:
-                break
-            logger.info(
-                "Downloading Failed Retry %d/%d", total_retry + 1, download_retries
-            )
-            total_retry += 1
-
+        # a failed attempt is retried by the queue, not inline, so the worker
+        # isn't held during the backoff
+        is_successful, exception = await download_ytdl(
+            [download_object.track.url or ""], ydl_config, ctx.executor, ctx.bandwidth
+        )
         if not is_successful:
             if exception:
                 raise Exception(
@@ -123,42 +137,49 @@ async def download(ctx: DownloadContext, orm: SessionDep):
             else:
                 raise Exception("Download Failed Inside sync_download_ytdl")
 
-        ctx.download_object.status = DownloadStatusEnum.SUCCESSFUL
-        ctx.download_object.file_path = ctx.file_path
-        orm.add(ctx.download_object)
+        download_object.status = DownloadStatusEnum.SUCCESSFUL
+        download_object.file_path = ctx.file_path
+        orm.add(download_object)
 
         logger.info(
             "Downloading Done %d saved into %s",
-            ctx.download_object.id,
-            ctx.download_object.file_path,
+            download_object.id,
+            download_object.file_path,
         )
 
     except asyncio.CancelledError:
-        logger.info("Download %d Canceled", ctx.download_object.id)
-        ctx.download_object.status = DownloadStatusEnum.FAILED
-        orm.add(ctx.download_object)
+        logger.info("Download %d Canceled", download_object.id)
+        download_object.status = DownloadStatusEnum.FAILED
+        orm.add(download_object)
 
         current_report = ctx.progress_reports.get(
-            ctx.download_object.id,
-            DownloadProgressReport(track_id=ctx.download_object.track_id),
+            download_object.id,
+            DownloadProgressReport(track_id=download_object.track_id),
         )
         current_report.status = DownloadStatusEnum.FAILED
-        ctx.progress_reports[ctx.download_object.id] = current_report
+        ctx.progress_reports[download_object.id] = current_report
 
     except Exception as err:
         logger.error("exception when downloading `%s`", err)
-        ctx.download_object.status = DownloadStatusEnum.FAILED
-        orm.add(ctx.download_object)
+        ctx.error = err
+        ctx.retry = ctx.attempt < download_retries
+        if ctx.retry:
+            logger.info("Downloading Failed Retry %d/%d", ctx.attempt, download_retries)
+        status = DownloadStatusEnum.PENDING if ctx.retry else DownloadStatusEnum.FAILED
+        download_object.status = status
+        orm.add(download_object)
 
         current_report = ctx.progress_reports.get(
-            ctx.download_object.id,
-            DownloadProgressReport(track_id=ctx.download_object.track_id),
+            download_object.id,
+            DownloadProgressReport(track_id=download_object.track_id),
         )
-        current_report.status = DownloadStatusEnum.FAILED
-        ctx.progress_reports[ctx.download_object.id] = current_report
+        current_report.status = status
+        ctx.progress_reports[download_object.id] = current_report
 
     try:
-        orm.commit()
-        ctx.progress_event.set()
+        await orm.commit()
+        # the player may hold the previous status of this track
+        track_file_cache.invalidate(download_object.track_id)
+        ctx.progress_hub.notify(download_object.id)
     except Exception as ex:
         logger.error("Error on Committing %s", ex)
\ No newline at end of file
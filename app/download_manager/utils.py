@@ -1,58 +1,55 @@
-import threading
-from sqlmodel import Session, case, select
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from app.core.db import new_async_session
 from app.core.logging import get_logger
-from app.download_manager import soundcloud_downloader
-from app.download_manager.manager import DownloadManager
-from app.models.playlist import DownloadStatusEnum, DownloadTrackModel
+from app.download_manager.manager import LOW_PRIORITY, DownloadManager
+from app.models.playlist import (
+    DownloadStatusEnum,
+    DownloadTrackModel,
+    PlaylistTrackLinkModel,
+    TrackModel,
+)
 
 logger = get_logger(__name__)
 
 
-async def add_downloads_to_download_manager(
-    orm: Session, download_manager: DownloadManager
-):
+async def add_downloads_to_download_manager(download_manager: DownloadManager):
+    # jobs are already persisted, only downloads that have none are queued
     logger.info("start adding downloads to download manager")
+    total = await download_manager.queue.recover()
+    logger.info("downloads objects added to download manager total %d", total)
+    download_manager.wakeup.set()
 
-    downloads_qs = (
-        select(DownloadTrackModel)
-        .where(
-            DownloadTrackModel.status.in_(  # type: ignore
-                [DownloadStatusEnum.PENDING, DownloadStatusEnum.DOWNLOADING]
-            )
-        )
-        .order_by(
-            case(
-                (DownloadTrackModel.status == DownloadStatusEnum.DOWNLOADING, 0),
-                (DownloadTrackModel.status == DownloadStatusEnum.PENDING, 1),
-                else_=2,
-            )
-        )
-    )
-    downloads = orm.exec(downloads_qs).fetchall()
 
-    for download in downloads:
-        ctx = soundcloud_downloader.DownloadContext(
-            progress_reports=download_manager.progress_reports,
-            progress_event=download_manager.progress_event,
-            cancel_event=threading.Event(),
-            download_object=download,
-        )
-        await download_manager.add_to_queue(
-            download.id or -1,
-            soundcloud_downloader.download(ctx, orm),  # type: ignore
-            ctx.cancel_event,
-            -1,
-        )
-
-    logger.info(
-        "downloads objects added to download manager total %d",
-        len(downloads),
+async def add_playlists_tracks_to_download_manager(
+    download_manager: DownloadManager, playlists_ids: list[int]
+):
+    """Queue the tracks of the playlists that were never downloaded"""
+    tracks_qs = (
+        select(TrackModel.id)
+        .join(PlaylistTrackLinkModel)
+        .outerjoin(DownloadTrackModel)
+        .where(PlaylistTrackLinkModel.playlist_id.in_(playlists_ids))  # type: ignore
+        .where(DownloadTrackModel.id.is_(None))  # type: ignore
+        .distinct()
     )
+    async with new_async_session() as orm:
+        tracks_ids = (await orm.exec(tracks_qs)).all()
+        downloads = [
+            DownloadTrackModel(
+                status=DownloadStatusEnum.PENDING, track_id=track_id, file_path=None
+            )
+            for track_id in tracks_ids
+        ]
+        orm.add_all(downloads)
+        try:
+            await orm.commit()
+        except IntegrityError as error:
+            # a track was queued from the api in the meantime, next sync retries
+            logger.error("can't add playlists tracks downloads: %s", error)
+            return
 
-    for download in downloads:
-        download.status = DownloadStatusEnum.PENDING
-    orm.commit()
-    logger.info(
-        "downloads object status [downloading, pending] changed to [pending] total %d",
-        len(downloads),
+    await download_manager.add_to_queue(
+        [download.id for download in downloads if download.id], LOW_PRIORITY
     )
+    logger.info("playlists tracks added to download manager total %d", len(downloads))
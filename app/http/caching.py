@@ -0,0 +1,39 @@
+from collections.abc import Mapping
+from email.utils import formatdate, parsedate_to_datetime
+
+
+def make_etag(file_size: int, mtime: float) -> str:
+    """Strong ETag of a file derived from its size and modification time"""
+    return f'"{file_size:x}-{int(mtime * 1_000_000):x}"'
+
+
+def http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of `If-None-Match` against an ETag (RFC 7232 3.2)"""
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+
+def is_not_modified(headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+    """Whether a conditional GET/HEAD can be answered with `304 Not Modified`.
+
+    `If-None-Match` takes precedence, `If-Modified-Since` is only checked when
+    the client didn't send an ETag.
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return int(mtime) <= since.timestamp()
+    return False
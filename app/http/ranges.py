@@ -0,0 +1,80 @@
+import re
+
+# RFC 7233 byte-range-spec / suffix-byte-range-spec
+BYTE_RANGE_SPEC = re.compile(r"^(\d*)-(\d*)$")
+# more ranges than this in a single request is treated as abuse and ignored
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(Exception):
+    def __init__(self, file_size: int) -> None:
+        super().__init__(f"no satisfiable range for size {file_size}")
+        self.file_size = file_size
+
+
+def parse_range_header(
+    range_header: str, file_size: int
+) -> list[tuple[int, int]] | None:
+    """Parse a `Range` header into sorted, merged `[start, end)` byte ranges.
+
+    Returns `None` when the header must be ignored (unknown unit, bad syntax
+    or too many ranges), in which case the whole file is served. Raises
+    `RangeNotSatisfiable` when the header is valid but no range overlaps the
+    file.
+    """
+    unit, _, range_set = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not range_set.strip():
+        return None
+
+    specs = [spec.strip() for spec in range_set.split(",") if spec.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+
+    ranges: list[tuple[int, int]] = []
+    for spec in specs:
+        match = BYTE_RANGE_SPEC.match(spec)
+        if not match or match.group(0) == "-":
+            return None
+        first, last = match.groups()
+
+        if not first:
+            # suffix range `-N` is the last N bytes of the file
+            suffix_length = int(last)
+            if suffix_length == 0 or file_size == 0:
+                continue
+            ranges.append((max(file_size - suffix_length, 0), file_size))
+            continue
+
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= file_size:
+            continue
+        end = min(int(last) + 1, file_size) if last else file_size
+        ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable(file_size)
+
+    # merge overlapping and adjacent ranges so no byte is sent twice
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(if_range: str | None, etag: str, last_modified: str) -> bool:
+    """Evaluate `If-Range`, only strong validators can allow a partial response."""
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith("W/"):
+        return False
+    if if_range.startswith('"'):
+        return if_range == etag
+    return if_range == last_modified
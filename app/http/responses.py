@@ -0,0 +1,184 @@
+import os
+from pathlib import Path
+from secrets import token_hex
+
+import anyio
+from fastapi import Response, status
+from starlette.types import Receive, Scope, Send
+
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+ZERO_COPY_SEND = "http.response.zerocopysend"
+PATH_SEND = "http.response.pathsend"
+
+
+class RangeFileResponse(Response):
+    """Send a file, or byte ranges of it, without buffering it in Python.
+
+    `ranges` are `[start, end)` pairs as returned by `parse_range_header`.
+    No ranges means the whole file with `200`, one range a plain `206` and
+    more than one a `206` `multipart/byteranges` body.
+
+    When the ASGI server supports the `zerocopysend` extension the file
+    descriptor is handed to it and the kernel copies each range straight into
+    the socket (`sendfile`). `pathsend` is used the same way for full-file
+    responses. Otherwise ranges are read in chunks with `pread` in a worker
+    thread, never past the end of the requested range.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        file_size: int,
+        media_type: str,
+        ranges: list[tuple[int, int]] | None = None,
+        headers: dict[str, str] | None = None,
+        chunk_size: int = 1024 * 1024,
+        zero_copy: bool = True,
+    ) -> None:
+        self.path = Path(path)
+        self.file_size = file_size
+        self.ranges = ranges or [(0, file_size)]
+        self.chunk_size = chunk_size
+        self.zero_copy = zero_copy
+        self.media_type = media_type
+        self.background = None
+        self.status_code = (
+            status.HTTP_206_PARTIAL_CONTENT if ranges else status.HTTP_200_OK
+        )
+        self.init_headers(headers)
+        self.headers["accept-ranges"] = "bytes"
+
+        self.part_headers: list[bytes] = []
+        self.closing_boundary = b""
+        if len(self.ranges) > 1:
+            boundary = token_hex(13)
+            self.part_headers = [
+                (
+                    f"--{boundary}\r\n"
+                    f"Content-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end - 1}/{file_size}\r\n"
+                    "\r\n"
+                ).encode("latin-1")
+                for start, end in self.ranges
+            ]
+            self.closing_boundary = f"--{boundary}--".encode("latin-1")
+            content_length = (
+                sum(len(part) + 2 for part in self.part_headers)
+                + sum(end - start for start, end in self.ranges)
+                + len(self.closing_boundary)
+            )
+            self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+            self.headers["content-length"] = str(content_length)
+        else:
+            start, end = self.ranges[0]
+            self.headers["content-length"] = str(end - start)
+            if ranges:
+                self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        extensions = scope.get("extensions", {})
+        send_header_only = scope["method"].upper() == "HEAD"
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if send_header_only or self.file_size == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif self.zero_copy and ZERO_COPY_SEND in extensions:
+            await self._zero_copy_send(send)
+        elif (
+            self.zero_copy
+            and PATH_SEND in extensions
+            and self.status_code == status.HTTP_200_OK
+        ):
+            await send({"type": PATH_SEND, "path": str(self.path)})
+        else:
+            await self._chunked_send(receive, send)
+
+    async def _send_part_header(self, send: Send, index: int) -> None:
+        if self.part_headers:
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": self.part_headers[index],
+                    "more_body": True,
+                }
+            )
+
+    async def _send_part_footer(self, send: Send, index: int) -> None:
+        if not self.part_headers:
+            return
+        last_part = index == len(self.ranges) - 1
+        await send(
+            {
+                "type": "http.response.body",
+                "body": b"\r\n" + self.closing_boundary if last_part else b"\r\n",
+                "more_body": not last_part,
+            }
+        )
+
+    async def _zero_copy_send(self, send: Send) -> None:
+        logger.debug("zero-copy send %s ranges %s", self.path, self.ranges)
+        fd = await anyio.to_thread.run_sync(os.open, self.path, os.O_RDONLY)
+        try:
+            for index, (start, end) in enumerate(self.ranges):
+                await self._send_part_header(send, index)
+                await send(
+                    {
+                        "type": ZERO_COPY_SEND,
+                        "file": fd,
+                        "offset": start,
+                        "count": end - start,
+                        "more_body": bool(self.part_headers),
+                    }
+                )
+                await self._send_part_footer(send, index)
+        finally:
+            os.close(fd)
+
+    async def _chunked_send(self, receive: Receive, send: Send) -> None:
+        logger.debug("chunked send %s ranges %s", self.path, self.ranges)
+
+        async def stream_file(cancel_scope: anyio.CancelScope) -> None:
+            fd = await anyio.to_thread.run_sync(os.open, self.path, os.O_RDONLY)
+            try:
+                for index, (start, end) in enumerate(self.ranges):
+                    await self._send_part_header(send, index)
+                    offset = start
+                    while offset < end:
+                        size = min(self.chunk_size, end - offset)
+                        chunk = await anyio.to_thread.run_sync(
+                            os.pread, fd, size, offset
+                        )
+                        if not chunk:
+                            raise RuntimeError(
+                                f"File {self.path} is shorter than expected"
+                            )
+                        offset += len(chunk)
+                        await send(
+                            {
+                                "type": "http.response.body",
+                                "body": chunk,
+                                "more_body": offset < end or bool(self.part_headers),
+                            }
+                        )
+                    await self._send_part_footer(send, index)
+            finally:
+                os.close(fd)
+            cancel_scope.cancel()
+
+        # stop reading from disk as soon as the listener goes away
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(stream_file, task_group.cancel_scope)
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    task_group.cancel_scope.cancel()
+                    break
@@ -1,6 +1,10 @@
+import asyncio
 from app.core import config
+from app.core.logging import get_logger
 from app.models.settings import SettingsModel
-from aiohttp import ClientSession as BaseClientSession
+from aiohttp import ClientSession as BaseClientSession, TCPConnector
+
+logger = get_logger(__name__)
 
 
 class ClientSession(BaseClientSession):
@@ -15,3 +19,75 @@ class ClientSession(BaseClientSession):
             kw["cookies"] = config.cookies
 
         super().__init__(*args, **kw)
+
+
+def create_connector() -> TCPConnector:
+    return TCPConnector(
+        limit=config.settings.http_pool_limit,
+        limit_per_host=config.settings.http_pool_limit_per_host,
+        ttl_dns_cache=config.settings.http_dns_cache_ttl,
+        keepalive_timeout=config.settings.http_keepalive_timeout,
+    )
+
+
+class SharedClientSession:
+    """Long-lived pooled `ClientSession` owned by the app lifespan.
+
+    Connections, DNS and TLS sessions are reused across syncs. The session is
+    rebuilt when the proxy or OAuth settings change, the previous one is
+    closed after a grace period so in-flight requests can finish.
+    """
+
+    def __init__(self) -> None:
+        self.session: ClientSession | None = None
+        self.session_key: tuple[str | None, str] | None = None
+        self._lock = asyncio.Lock()
+        self._retired: dict[asyncio.Task, ClientSession] = {}
+
+    @staticmethod
+    def get_session_key(settings: SettingsModel | None) -> tuple[str | None, str]:
+        if settings:
+            return settings.get_http_proxy(), settings.get_soundcloud_oauth()
+        return config.settings.http_proxy, config.settings.soundcloud_oauth
+
+    async def get(self, settings: SettingsModel | None) -> ClientSession:
+        session_key = self.get_session_key(settings)
+        if self.session and not self.session.closed and self.session_key == session_key:
+            return self.session
+
+        async with self._lock:
+            if (
+                self.session
+                and not self.session.closed
+                and self.session_key == session_key
+            ):
+                return self.session
+            return self._build(settings, session_key)
+
+    async def rebuild(self, settings: SettingsModel | None) -> None:
+        async with self._lock:
+            self._build(settings, self.get_session_key(settings))
+
+    def _build(
+        self, settings: SettingsModel | None, session_key: tuple[str | None, str]
+    ) -> ClientSession:
+        logger.info("build shared http client session")
+        if self.session:
+            task = asyncio.create_task(self._close_later(self.session))
+            self._retired[task] = self.session
+            task.add_done_callback(self._retired.pop)
+        self.session = ClientSession(settings, connector=create_connector())
+        self.session_key = session_key
+        return self.session
+
+    async def _close_later(self, session: ClientSession) -> None:
+        await asyncio.sleep(config.settings.http_session_close_delay)
+        await session.close()
+
+    async def close(self) -> None:
+        for task, session in list(self._retired.items()):
+            task.cancel()
+            await session.close()
+        if self.session:
+            await self.session.close()
+        self.session = None
@@ -1,18 +1,24 @@
 import asyncio
 from sqlmodel import select
 from app.core import config
+from app.core.executor import MeteredThreadPoolExecutor
 from app.core.logging import setup_logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from app.download_manager import soundcloud_downloader
 from app.download_manager.manager import DownloadManager
 from app.download_manager.utils import add_downloads_to_download_manager
+from app.http.session import SharedClientSession
+from app.soundcloud.download import ytdl_process_pool
 from app.models.settings import SettingsModel
 from app.services.playlist_service import router as playlist_router
 from app.services.settings_service import router as settings_router
 from app.services.download_service import router as downloads_router
 from app.services.player_service import router as player_router
 from app.services.frontend_service import router as frontend_router
-from app.core.db import create_db_and_tables, get_session
+from app.sync_manager.manager import SyncManager
+from app.sync_manager.scheduler import SyncScheduler
+from app.core.db import create_db_and_tables, new_async_session
 from contextlib import asynccontextmanager
 
 setup_logging(__name__)
@@ -20,19 +26,37 @@ setup_logging(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    create_db_and_tables()
-    session = next(get_session())
-    settings_query = select(SettingsModel)
-    settings_obj = session.exec(settings_query).one_or_none()
+    await create_db_and_tables()
+    async with new_async_session() as session:
+        settings_query = select(SettingsModel)
+        settings_obj = (await session.exec(settings_query)).one_or_none()
     concurrent_downloads = getattr(
         settings_obj, "concurrent_downloads", config.settings.concurrent_downloads
     )
-    app.state.downloader = DownloadManager(concurrent_downloads)
-    asyncio.create_task(app.state.downloader.worker())
-    asyncio.create_task(
-        add_downloads_to_download_manager(session, app.state.downloader)
+    # metered to report its saturation next to the downloads executor
+    app.state.default_executor = MeteredThreadPoolExecutor()
+    asyncio.get_running_loop().set_default_executor(app.state.default_executor)
+    app.state.http_client = SharedClientSession()
+    app.state.downloader = DownloadManager(
+        concurrent_downloads, soundcloud_downloader.download
     )
+    app.state.downloader.start()
+    asyncio.create_task(add_downloads_to_download_manager(app.state.downloader))
+    app.state.sync_manager = SyncManager(
+        app.state.http_client,
+        config.settings.sync_concurrent_playlists,
+        config.settings.sync_jobs_history,
+    )
+    app.state.sync_scheduler = SyncScheduler(
+        app.state.sync_manager, app.state.downloader
+    )
+    app.state.sync_scheduler.start()
     yield
+    await app.state.sync_scheduler.stop()
+    await app.state.sync_manager.stop()
+    await app.state.downloader.stop()
+    ytdl_process_pool.close()
+    await app.state.http_client.close()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -56,5 +80,6 @@ app.add_middleware(
     allow_origins="*",
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Link"],
     allow_credentials=True,
 )
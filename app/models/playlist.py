@@ -2,10 +2,15 @@ import enum
 from typing import Optional
 from datetime import datetime
 from fastapi import Request
+from sqlalchemy import Index
 from sqlmodel import Field, SQLModel, Relationship, UniqueConstraint, Column, Enum
 
 from app.schemas.playlist import PlaylistSchema, TrackSchema
 
+# relationships must be loaded explicitly in the query (selectinload/joinedload),
+# touching an unloaded one raises instead of silently issuing a query per row
+NO_LAZY_LOAD = {"lazy": "raise_on_sql"}
+
 
 class PlaylistTrackLinkModel(SQLModel, table=True):
     playlist_id: int | None = Field(
@@ -46,7 +51,9 @@ class PlaylistModel(PlaylistBaseModel, table=True):
     )
     id: int | None = Field(primary_key=True)
     tracks: list["TrackModel"] = Relationship(
-        back_populates="playlists", link_model=PlaylistTrackLinkModel
+        back_populates="playlists",
+        link_model=PlaylistTrackLinkModel,
+        sa_relationship_kwargs=NO_LAZY_LOAD,
     )
 
 
@@ -57,8 +64,24 @@ class PlaylistPublicModel(PlaylistBaseModel):
 class PlaylistCreateModel(PlaylistBaseModel): ...
 
 
+class PlaylistSyncStateModel(SQLModel, table=True):
+    """`last_modified`/`track_count` of a playlist when its tracks were last
+    synced, an unchanged playlist doesn't need to be fetched again"""
+
+    playlist_id: int = Field(foreign_key="playlistmodel.id", primary_key=True)
+    last_modified: datetime = Field()
+    track_count: int = Field()
+    synced_at: datetime = Field()
+
+    def is_up_to_date(self, playlist: PlaylistModel) -> bool:
+        return (
+            self.last_modified == playlist.last_modified
+            and self.track_count == playlist.track_count
+        )
+
+
 class TrackBaseModel(SQLModel):
-    platform_id: str = Field(index=True)
+    platform_id: str = Field()
     url: str | None = Field()
     name: str = Field()
     artist_name: str | None = Field()
@@ -78,12 +101,21 @@ class TrackBaseModel(SQLModel):
 
 
 class TrackModel(TrackBaseModel, table=True):
+    # an index, unlike a constraint, can be added to an existing table,
+    # sync upserts tracks on it
+    __table_args__ = (
+        Index("trackmodel_platform_id_unique", "platform_id", unique=True),
+    )
     id: int | None = Field(primary_key=True, index=True)
 
     playlists: list["PlaylistModel"] = Relationship(
-        back_populates="tracks", link_model=PlaylistTrackLinkModel
+        back_populates="tracks",
+        link_model=PlaylistTrackLinkModel,
+        sa_relationship_kwargs=NO_LAZY_LOAD,
+    )
+    download: Optional["DownloadTrackModel"] = Relationship(
+        back_populates="track", sa_relationship_kwargs=NO_LAZY_LOAD
     )
-    download: Optional["DownloadTrackModel"] = Relationship(back_populates="track")
 
     def to_public_model(self, request: Request) -> "TrackPublicModel":
         return TrackPublicModel(
@@ -108,10 +140,28 @@ class DownloadTrackBaseModel(SQLModel):
 class DownloadTrackModel(DownloadTrackBaseModel, table=True):
     id: int | None = Field(default=None, primary_key=True)
     track_id: int = Field(foreign_key="trackmodel.id", unique=True)
-    track: TrackModel = Relationship(back_populates="download")
+    track: TrackModel = Relationship(
+        back_populates="download", sa_relationship_kwargs=NO_LAZY_LOAD
+    )
 
 
 
+class DownloadJobModel(SQLModel, table=True):
+    """Queued download of a `DownloadTrackModel`, claimed by a worker with a
+    lease. Lower `rank` runs first, it's `priority` aged by the time queued."""
+
+    __table_args__ = (Index("downloadjobmodel_rank", "rank"),)
+    id: int | None = Field(default=None, primary_key=True)
+    download_id: int = Field(foreign_key="downloadtrackmodel.id", unique=True)
+    priority: int = Field()
+    rank: float = Field()
+    attempts: int = Field(default=0)
+    next_run_at: datetime = Field()
+    lease_owner: str | None = Field(default=None)
+    lease_expires_at: datetime | None = Field(default=None)
+    enqueued_at: datetime = Field()
+
+
 class DownloadTrackPublicModel(DownloadTrackBaseModel):
     id: int
     track: TrackModel
@@ -1,3 +1,4 @@
+from datetime import datetime
 from sqlmodel import SQLModel, Field
 from app.core import config
 from app.core.config import settings
@@ -43,3 +44,12 @@ class SettingsCreateModel(SettingBaseModel): ...
 
 
 class SettingsUpdateModel(SettingBaseModel): ...
+
+
+class SoundCloudCredentialsModel(SQLModel, table=True):
+    """Last scraped public credentials of the SoundCloud web app"""
+
+    id: int | None = Field(default=None, primary_key=True)
+    client_id: str = Field()
+    app_version: str = Field()
+    fetched_at: datetime = Field()
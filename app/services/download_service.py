@@ -1,59 +1,105 @@
-from asyncio import sleep
-import json
-import threading
-from fastapi import HTTPException, Request, status
-from fastapi.encoders import jsonable_encoder
+from typing import Annotated
+from fastapi import HTTPException, Query, Request, Response, status
 
 from fastapi.responses import StreamingResponse
 from fastapi.routing import APIRouter
+from sqlalchemy.orm import joinedload
 from sqlmodel import select
-from app.core.db import SessionDep
+from app.core import config
+from app.core.cache import track_file_cache
+from app.core.db import AsyncSessionDep
+from app.core.executor import starlette_threads_stats
 from app.core.logging import get_logger
-from app.download_manager.manager import DownloadProgressReport
+from app.core.progress import ProgressHub
+from app.core.pagination import (
+    CursorQuery,
+    FieldsQuery,
+    LimitQuery,
+    keyset_page,
+    page_headers,
+    parse_fields,
+    projection_response,
+    projection_statement,
+    split_page,
+)
+from app.download_manager.manager import HIGH_PRIORITY, DownloadProgressReport
 from app.models.playlist import (
     DownloadTrackDataModel,
     DownloadTrackModel,
     DownloadTrackPublicModel,
     DownloadStatusEnum,
     PlaylistModel,
+    PlaylistTrackLinkModel,
 )
 from app.models.playlist import TrackModel
-from app.download_manager import soundcloud_downloader
 router = APIRouter(prefix="/downloads")
 logger = get_logger(__name__)
 
 @router.get("/", response_model=list[DownloadTrackPublicModel])
-async def downloads_list(orm: SessionDep):
-    query = (
-        select(DownloadTrackModel)
-        .where(DownloadTrackModel.status.not_in([DownloadStatusEnum.SUCCESSFUL]))  # type: ignore
-        .order_by(DownloadTrackModel.status)
+async def downloads_list(
+    orm: AsyncSessionDep,
+    request: Request,
+    response: Response,
+    cursor: CursorQuery = None,
+    limit: LimitQuery = config.settings.page_size,
+    fields: FieldsQuery = None,
+):
+    projection = parse_fields(fields, DownloadTrackModel)
+    if projection:
+        query = projection_statement(DownloadTrackModel, projection)
+    else:
+        query = select(DownloadTrackModel).options(
+            joinedload(DownloadTrackModel.track)  # type: ignore
+        )
+    query = keyset_page(
+        query.where(DownloadTrackModel.status.not_in([DownloadStatusEnum.SUCCESSFUL])),  # type: ignore
+        DownloadTrackModel.id,
+        cursor,
+        limit,
     )
-    items = orm.exec(query).fetchall()
+    items, next_cursor = split_page((await orm.exec(query)).fetchall(), limit)
     if not items:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Items Not Found"
         )
+    headers = page_headers(request, next_cursor)
+
+    if projection:
+        return projection_response([item._asdict() for item in items], headers)
+    response.headers.update(headers)
     return items
 
 
 @router.post("/{id}/cancel/", response_model=DownloadTrackDataModel)
-async def cancel_download(id: int, orm: SessionDep, request: Request):
+async def cancel_download(id: int, orm: AsyncSessionDep, request: Request):
     query = select(DownloadTrackModel).where(DownloadTrackModel.id == id)
-    item = orm.exec(query).one_or_none()
+    item = (await orm.exec(query)).one_or_none()
     if not item:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Item Not Found"
         )
     await request.app.state.downloader.cancel_download(item.id)
-    orm.delete(item)
-    orm.commit()
+    await orm.delete(item)
+    await orm.commit()
+    track_file_cache.invalidate(item.track_id)
     return item
 
+@router.post("/{id}/priority/")
+async def reprioritize_download(
+    id: int,
+    priority: Annotated[int, Query(description="Lower runs first, 0 is the highest")],
+    request: Request,
+):
+    if not await request.app.state.downloader.reprioritize(id, priority):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Download Job Not Queued"
+        )
+    return {"id": id, "priority": priority}
+
 @router.post("/{id}/retry")
-async def retry_download(id: int, orm: SessionDep, request: Request):
+async def retry_download(id: int, orm: AsyncSessionDep, request: Request):
     download_track_query = select(DownloadTrackModel).where(DownloadTrackModel.id == id)
-    download_item = orm.exec(download_track_query).one_or_none()
+    download_item = (await orm.exec(download_track_query)).one_or_none()
     if not download_item:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail="Download Job Not Found"
@@ -61,21 +107,9 @@ async def retry_download(id: int, orm: SessionDep, request: Request):
 
     download_item.status = DownloadStatusEnum.DOWNLOADING
     orm.add(download_item)
-    orm.commit()
-    cancel_event = threading.Event()
-    ctx = soundcloud_downloader.DownloadContext(
-        progress_reports=request.app.state.downloader.progress_reports,
-        progress_event=request.app.state.downloader.progress_event,
-        cancel_event=cancel_event,
-        download_object=download_item,
-    )
-
-    await request.app.state.downloader.add_to_queue(
-        download_item.id,
-        soundcloud_downloader.download(ctx, orm),  # type: ignore
-        cancel_event,
-        -1,
-    )
+    await orm.commit()
+    track_file_cache.invalidate(download_item.track_id)
+    await request.app.state.downloader.add_to_queue([download_item.id], HIGH_PRIORITY)
 
     return download_item
 
@@ -83,9 +117,9 @@ async def retry_download(id: int, orm: SessionDep, request: Request):
     "/playlists/tracks/{track_id}",
     response_model=DownloadTrackDataModel,
 )
-async def download_track(track_id: int, orm: SessionDep, request: Request):
+async def download_track(track_id: int, orm: AsyncSessionDep, request: Request):
     track_query = select(TrackModel).where(TrackModel.id == track_id)
-    track_obj = orm.exec(track_query).one_or_none()
+    track_obj = (await orm.exec(track_query)).one_or_none()
     if not track_obj:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Track Not Found"
@@ -93,7 +127,7 @@ async def download_track(track_id: int, orm: SessionDep, request: Request):
     download_track_query = select(DownloadTrackModel).where(
         DownloadTrackModel.track_id == track_id
     )
-    download_track_obj = orm.exec(download_track_query).one_or_none()
+    download_track_obj = (await orm.exec(download_track_query)).one_or_none()
     if download_track_obj:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail="This Track Already Is Exists"
@@ -105,92 +139,71 @@ async def download_track(track_id: int, orm: SessionDep, request: Request):
         file_path=None,
     )
     orm.add(download_item)
-    orm.commit()
-    cancel_event = threading.Event()
-    ctx = soundcloud_downloader.DownloadContext(
-        progress_reports=request.app.state.downloader.progress_reports,
-        progress_event=request.app.state.downloader.progress_event,
-        cancel_event=cancel_event,
-        download_object=download_item,
-    )
-
-    await request.app.state.downloader.add_to_queue(
-        download_item.id,
-        soundcloud_downloader.download(ctx, orm),  # type: ignore
-        cancel_event,
-        -1,
-    )
+    await orm.commit()
+    await request.app.state.downloader.add_to_queue([download_item.id], HIGH_PRIORITY)
 
     return download_item
 
+@router.get("/executors/")
+async def executors_stats(request: Request):
+    """Saturation of the thread pools, downloads run on their own"""
+    return {
+        "downloads": request.app.state.downloader.executor.stats(),
+        "default": request.app.state.default_executor.stats(),
+        "starlette": starlette_threads_stats(),
+    }
+
 @router.get("/progress-reports/")
 async def download_progress_reports(
     request: Request,
 ):
-    progress_reports: dict[int, DownloadProgressReport] = (
-        request.app.state.downloader.progress_reports
-    )
+    """A `snapshot` event with every report first, then messages with only
+    the reports that changed"""
+    progress_hub: ProgressHub = request.app.state.downloader.progress_hub
 
     async def progress_generator():
-        while True:
-            if await request.is_disconnected():
-                break
-
-            await request.app.state.downloader.progress_event.wait()
-            request.app.state.downloader.progress_event.clear()
-
-            progresses = progress_reports.copy()
-            data = json.dumps(jsonable_encoder(progresses))
-
-            yield f"data: {data}\n\n"
-            await sleep(0.5)
+        with progress_hub.subscribe() as subscriber:
+            while not await request.is_disconnected():
+                yield await subscriber.get()
 
     return StreamingResponse(progress_generator(), media_type="text/event-stream")
 
 
 @router.get("/progress-report/{playlist_id}/playlist")
 async def download_playlist_progress_report(
-    playlist_id: int, request: Request, orm: SessionDep
+    playlist_id: int, request: Request, orm: AsyncSessionDep
 ):
-    progress_reports: dict[int, DownloadProgressReport] = (
-        request.app.state.downloader.progress_reports
-    )
+    """Reports of the playlist tracks by track id, a `snapshot` event with
+    all of them first, then messages with only those that changed"""
+    progress_hub: ProgressHub = request.app.state.downloader.progress_hub
     playlist_qs = select(PlaylistModel).where(PlaylistModel.id == playlist_id)
-    playlist_obj = orm.exec(playlist_qs).one_or_none()
+    playlist_obj = (await orm.exec(playlist_qs)).one_or_none()
     if not playlist_obj:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Playlist Not Found"
         )
-    tracks_ids_lookup = set([obj.id for obj in playlist_obj.tracks])
-
-    async def progress_generator(tracks_ids_lookup):
-        while True:
-            if await request.is_disconnected():
-                break
-
-            # Refresh items when this api start sooner then sync tracks API
-            # if it be disabled it has a chance that don't show updated data
-            if not tracks_ids_lookup:
-                orm.refresh(playlist_obj)
-                tracks_ids_lookup = set([obj.id for obj in playlist_obj.tracks])
-
-            await request.app.state.downloader.progress_event.wait()
-            request.app.state.downloader.progress_event.clear()
-
-            current = progress_reports.copy()
-            playlist_progress = {
-                obj.track_id: obj
-                for obj in current.values()
-                if obj.track_id in tracks_ids_lookup
-            }
-            data = json.dumps(jsonable_encoder(playlist_progress))
-            yield f"data: {data}\n\n"
-            await sleep(0.5)
-
-    return StreamingResponse(
-        progress_generator(tracks_ids_lookup), media_type="text/event-stream"
+    tracks_ids_qs = select(PlaylistTrackLinkModel.track_id).where(
+        PlaylistTrackLinkModel.playlist_id == playlist_id
     )
+    tracks_ids_lookup = set((await orm.exec(tracks_ids_qs)).fetchall())
+
+    def track_key(_, report: DownloadProgressReport) -> int | None:
+        return report.track_id if report.track_id in tracks_ids_lookup else None
+
+    async def progress_generator():
+        with progress_hub.subscribe(track_key) as subscriber:
+            while not await request.is_disconnected():
+                # Refresh items when this api start sooner then sync tracks API
+                # if it be disabled it has a chance that don't show updated data
+                if not tracks_ids_lookup:
+                    tracks_ids_lookup.update((await orm.exec(tracks_ids_qs)).fetchall())
+                    if tracks_ids_lookup:
+                        subscriber.resync()
+
+                yield await subscriber.get()
+
+    return StreamingResponse(progress_generator(), media_type="text/event-stream")
 
 
 @router.post("/playlists/{id}/tracks")
-async def download_playlist(orm: SessionDep): ...
+async def download_playlist(orm: AsyncSessionDep): ...
@@ -1,20 +1,38 @@
+import re
 from pathlib import Path
+from fastapi import Request, Response, status
 from fastapi.responses import FileResponse
 from fastapi.routing import APIRouter
 
 from app.core import config
+from app.http.caching import http_date, is_not_modified, make_etag
 
 router = APIRouter()
 
+immutable_pattern = re.compile(config.settings.frontend_immutable_pattern)
+
 
 @router.get("/{path:path}", include_in_schema=False)
-def dashboard(path: str):
+def dashboard(path: str, request: Request):
     if path.startswith("api/"):
         return {"detail": "Not Found"}
 
     frontend_path = Path(config.settings.frontend_path)
     file_path = frontend_path / path
-    if path and file_path.exists():
-        return FileResponse(file_path)
+    cache_control = config.settings.frontend_cache_control
+    if path and file_path.is_file():
+        if immutable_pattern.match(path):
+            cache_control = config.settings.frontend_immutable_cache_control
+    else:
+        file_path = frontend_path / "index.html"
+
+    file_stat = file_path.stat()
+    headers = {
+        "ETag": make_etag(file_stat.st_size, file_stat.st_mtime),
+        "Last-Modified": http_date(file_stat.st_mtime),
+        "Cache-Control": cache_control,
+    }
+    if is_not_modified(request.headers, headers["ETag"], file_stat.st_mtime):
+        return Response(headers=headers, status_code=status.HTTP_304_NOT_MODIFIED)
 
-    return FileResponse(frontend_path / "index.html")
+    return FileResponse(file_path, headers=headers, stat_result=file_stat)
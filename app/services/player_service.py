@@ -1,12 +1,19 @@
-from pathlib import Path
+import anyio
+from dataclasses import replace
 from fastapi import HTTPException, Request, status, Response
 from fastapi.routing import APIRouter
+from sqlalchemy.orm import selectinload
 from sqlmodel import select
 from app.core import config
-from app.core.db import SessionDep
+from app.core.cache import TrackFileInfo, track_file_cache
+from app.core.db import AsyncSessionDep
 from app.core.logging import get_logger
+from app.download_manager.bandwidth import BandwidthBudget
 from app.models.playlist import DownloadStatusEnum, TrackModel
-from fastapi.responses import StreamingResponse
+from app.http.caching import http_date, is_not_modified, make_etag
+from app.http.ranges import RangeNotSatisfiable, if_range_matches, parse_range_header
+from app.http.responses import RangeFileResponse
+from starlette.types import Receive, Scope, Send
 
 from mimetypes import guess_type
 
@@ -14,124 +21,127 @@ logger = get_logger(__name__)
 router = APIRouter(prefix="/player")
 
 
-def file_streamer(file_path: Path, start: int, end: int, chunk_size: int):
-    total_size = end - start
-    logger.info(
-        "Start Streaming File %s Range %d-%d Chunk-Size %d",
-        file_path,
-        start,
-        end,
-        chunk_size,
-    )
-    with open(file_path, "rb") as file:
-        file.seek(start)
-        while total_size >= 0:
-            total_size -= min(chunk_size, chunk_size)
-            chunk = file.read(min(chunk_size, chunk_size))
-            yield chunk
-    logger.info("Ended Streaming File :%s ", file_path)
-
-
-@router.head("/{track_id}/play")
-async def play_track_head(track_id: int, orm: SessionDep):
-    track_query = select(TrackModel).where(TrackModel.id == track_id)
-    track_obj = orm.exec(track_query).one_or_none()
-
-    if not track_obj:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Track Not Found"
+async def get_track_file(track_id: int, orm: AsyncSessionDep) -> TrackFileInfo:
+    """Resolve the downloaded file of a track, served from `track_file_cache`
+    when possible so seeking doesn't touch the database"""
+    track_file = track_file_cache.get(track_id)
+    if not track_file:
+        track_query = (
+            select(TrackModel)
+            .where(TrackModel.id == track_id)
+            .options(selectinload(TrackModel.download))  # type: ignore
         )
-    elif (
-        not track_obj.download
-        or not track_obj.download.file_path
-        or track_obj.download.status != DownloadStatusEnum.SUCCESSFUL
-    ):
+        track_obj = (await orm.exec(track_query)).one_or_none()
+        if not track_obj:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Track Not Found"
+            )
+
+        download = track_obj.download
+        file_path = download.file_path if download else None
+        file_type, _ = guess_type(file_path) if file_path else (None, None)
+        track_file = TrackFileInfo(
+            file_path=file_path,
+            status=download.status if download else None,
+            # fallback type when type can't find
+            media_type=file_type or "application/octet-stream",
+        )
+        track_file_cache.set(track_id, track_file)
+
+    if not track_file.file_path or track_file.status != DownloadStatusEnum.SUCCESSFUL:
         raise HTTPException(
             status_code=status.HTTP_425_TOO_EARLY, detail="Track Is Not Downloaded Yet"
         )
-    elif not Path(track_obj.download.file_path).exists():
+
+    try:
+        file_stat = await anyio.Path(track_file.file_path).stat()
+    except FileNotFoundError:
+        track_file_cache.invalidate(track_id)
         raise HTTPException(
             status_code=status.HTTP_424_FAILED_DEPENDENCY,
             detail="File Not Found On The Disk",
         )
 
-    file_path = track_obj.download.file_path
-    file_size = Path(file_path).stat().st_size
-    file_type, _ = guess_type(file_path)
-    # fallback type when type can't find
-    file_type = file_type or "application/octet-stream"
-
-    headers = {
-        "Accept-Ranges": "bytes",
-        "Content-Length": str(file_size),
-        "Content-Type": file_type,
-    }
-    return Response(headers=headers, status_code=status.HTTP_200_OK)
-
-
-@router.get("/{track_id}/play", name="play-track")
-async def play_track(track_id: int, orm: SessionDep, request: Request):
-    track_query = select(TrackModel).where(TrackModel.id == track_id)
-    track_obj = orm.exec(track_query).one_or_none()
-    if not track_obj:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Track Not Found"
-        )
-    elif (
-        not track_obj.download
-        or not track_obj.download.file_path
-        or track_obj.download.status != DownloadStatusEnum.SUCCESSFUL
+    # file replaced on disk, refresh size and mtime
+    if (file_stat.st_size, file_stat.st_mtime) != (
+        track_file.file_size,
+        track_file.mtime,
     ):
-        raise HTTPException(
-            status_code=status.HTTP_425_TOO_EARLY, detail="Track Is Not Downloaded Yet"
-        )
-    elif not Path(track_obj.download.file_path).exists():
-        raise HTTPException(
-            status_code=status.HTTP_424_FAILED_DEPENDENCY,
-            detail="File Not Found On The Disk",
+        track_file = replace(
+            track_file, file_size=file_stat.st_size, mtime=file_stat.st_mtime
         )
+        track_file_cache.set(track_id, track_file)
 
-    file_path = Path(track_obj.download.file_path)
-    file_size: int = file_path.stat().st_size
+    return track_file
 
-    range_header = request.headers.get("range", "").lstrip("bytes=")
-    if not range_header:
-        start_range, end_range = 0, file_size - 1
-    else:
-        start_range, end_range = range_header.split("-")
 
-        # browser can send empty range empty so we set fallback
-        start_range = start_range or 0
-        end_range = end_range or file_size - 1
+class PlayerStreamResponse(RangeFileResponse):
+    """Counts as an active stream of `bandwidth` while being sent, downloads
+    leave it some headroom"""
 
-        # parse to int
-        start_range = int(start_range)
-        end_range = int(end_range)
+    def __init__(self, *args, bandwidth: BandwidthBudget, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.bandwidth = bandwidth
 
-    # headers values
-    file_type, _ = guess_type(file_path)
-    # fallback type when type can't find
-    file_type = file_type or "application/octet-stream"
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        with self.bandwidth.stream():
+            await super().__call__(scope, receive, send)
 
-    content_range = f"bytes {start_range}-{end_range}/{file_size}"
 
-    headers = {
-        "Accept-Ranges": "bytes",
-        "Content-Type": file_type,
-        "Content-Range": content_range,
+def validator_headers(track_file: TrackFileInfo) -> dict[str, str]:
+    return {
+        "ETag": make_etag(track_file.file_size, track_file.mtime),
+        "Last-Modified": http_date(track_file.mtime),
+        "Cache-Control": config.settings.stream_cache_control,
     }
 
-    return StreamingResponse(
-        status_code=status.HTTP_206_PARTIAL_CONTENT
-        if range_header
-        else status.HTTP_200_OK,
-        headers=headers,
-        content=file_streamer(
-            file_path,
-            start_range,
-            end_range,
-            config.settings.stream_chunk_size,
-        ),
+
+@router.head("/{track_id}/play")
+async def play_track_head(track_id: int, orm: AsyncSessionDep, request: Request):
+    track_file = await get_track_file(track_id, orm)
+    headers = validator_headers(track_file)
+    if is_not_modified(request.headers, headers["ETag"], track_file.mtime):
+        return Response(headers=headers, status_code=status.HTTP_304_NOT_MODIFIED)
+
+    headers.update(
+        {
+            "Accept-Ranges": "bytes",
+            "Content-Length": str(track_file.file_size),
+            "Content-Type": track_file.media_type,
+        }
     )
+    return Response(headers=headers, status_code=status.HTTP_200_OK)
 
 
+@router.get("/{track_id}/play", name="play-track")
+async def play_track(track_id: int, orm: AsyncSessionDep, request: Request):
+    track_file = await get_track_file(track_id, orm)
+    file_size = track_file.file_size
+    headers = validator_headers(track_file)
+    if is_not_modified(request.headers, headers["ETag"], track_file.mtime):
+        return Response(headers=headers, status_code=status.HTTP_304_NOT_MODIFIED)
+
+    ranges = None
+    range_header = request.headers.get("range")
+    if range_header and if_range_matches(
+        request.headers.get("if-range"), headers["ETag"], headers["Last-Modified"]
+    ):
+        try:
+            ranges = parse_range_header(range_header, file_size)
+        except RangeNotSatisfiable:
+            raise HTTPException(
+                status_code=status.HTTP_416_RANGE_NOT_SATISFIABLE,
+                detail="Requested Range Not Satisfiable",
+                headers={"Content-Range": f"bytes */{file_size}"},
+            )
+
+    return PlayerStreamResponse(
+        track_file.file_path or "",
+        file_size=file_size,
+        media_type=track_file.media_type,
+        ranges=ranges,
+        headers=headers,
+        chunk_size=config.settings.stream_chunk_size,
+        zero_copy=config.settings.stream_zero_copy,
+        bandwidth=request.app.state.downloader.bandwidth,
+    )
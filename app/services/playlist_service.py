@@ -1,36 +1,66 @@
 import aiohttp
-from fastapi import APIRouter, Path, HTTPException, Request, status
+from fastapi import APIRouter, Path, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from typing import Annotated
 from app.core import config
-from app.core.db import SessionDep
+from app.core.db import AsyncSessionDep
+from app.core.pagination import (
+    CursorQuery,
+    FieldsQuery,
+    LimitQuery,
+    keyset_page,
+    page_headers,
+    parse_fields,
+    projection_response,
+    projection_statement,
+    split_page,
+)
 from app.core.logging import get_logger
-from app.http.session import ClientSession
 from app.models.playlist import (
     PlaylistModel,
     PlaylistPublicModel,
     TrackModel,
     TrackPublicModel,
 )
-from app.models.settings import SettingsModel
-from app.soundcloud.auth import SoundCloudAuth, get_app_version, get_client_id
-from app.soundcloud.playlist import get_playlists, get_playlist_tracks
-from sqlmodel import select, or_
+from app.sync_manager.manager import SyncJobReport, SyncManager
+from sqlalchemy.orm import joinedload
+from sqlmodel import select
 
 router = APIRouter(prefix="/playlists")
 logger = get_logger(__name__)
 
 
 @router.get("/", response_model=list[PlaylistPublicModel])
-async def playlists(orm: SessionDep):
-    statement = select(PlaylistModel)
-    items = orm.exec(statement).fetchall()
+async def playlists(
+    orm: AsyncSessionDep,
+    request: Request,
+    response: Response,
+    cursor: CursorQuery = None,
+    limit: LimitQuery = config.settings.page_size,
+    fields: FieldsQuery = None,
+):
+    projection = parse_fields(fields, PlaylistModel)
+    statement = (
+        projection_statement(PlaylistModel, projection)
+        if projection
+        else select(PlaylistModel)
+    )
+    statement = keyset_page(statement, PlaylistModel.id, cursor, limit)
+    items, next_cursor = split_page((await orm.exec(statement)).fetchall(), limit)
+    headers = page_headers(request, next_cursor)
+
+    if projection:
+        return projection_response([item._asdict() for item in items], headers)
+    response.headers.update(headers)
     return items
 
 
 @router.get("/{id:int}/", response_model=PlaylistPublicModel)
-async def playlist(id: Annotated[int, Path(title="ID of playlist")], orm: SessionDep):
+async def playlist(
+    id: Annotated[int, Path(title="ID of playlist")], orm: AsyncSessionDep
+):
     playlist_statement = select(PlaylistModel).where(PlaylistModel.id == id)
-    playlist_obj = orm.exec(playlist_statement).one_or_none()
+    playlist_obj = (await orm.exec(playlist_statement)).one_or_none()
     if not playlist_obj:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Playlist Not Found")
     return playlist_obj
@@ -38,70 +68,67 @@ async def playlist(id: Annotated[int, Path(title="ID of playlist")], orm: Sessio
 
 @router.get("/{id:int}/tracks/", response_model=list[TrackPublicModel])
 async def tracks(
-    id: Annotated[int, Path(title="ID of playlist")], orm: SessionDep, request: Request
+    id: Annotated[int, Path(title="ID of playlist")],
+    orm: AsyncSessionDep,
+    request: Request,
+    response: Response,
+    cursor: CursorQuery = None,
+    limit: LimitQuery = config.settings.page_size,
+    fields: FieldsQuery = None,
 ):
-    tracks_statement = select(TrackModel).where(TrackModel.playlists.any(id=id))  # type: ignore
-    tracks = orm.exec(tracks_statement).fetchall()
-    return [track.to_public_model(request) for track in tracks]
-
-
-@router.post("/sync/")
-async def sync_playlists(orm: SessionDep):
-
-    settings_query = select(SettingsModel)
-    settings = orm.exec(settings_query).one_or_none()
-    async with ClientSession(settings=settings) as session:
-        client_id = await get_client_id(session)
-        app_version = await get_app_version(session)
-        sc_auth = SoundCloudAuth(
-            client_id,
-            app_version,
-            oauth=settings.get_soundcloud_oauth()
-            if settings
-            else config.settings.soundcloud_oauth,
+    projection = parse_fields(fields, TrackModel, computed=["stream_url"])
+    if projection:
+        tracks_statement = projection_statement(TrackModel, projection)
+    else:
+        tracks_statement = select(TrackModel).options(
+            joinedload(TrackModel.download)  # type: ignore
         )
-        res = await get_playlists(session, sc_auth)
-
-    items_id = [obj.platform_id for obj in res]
-    logger.info("palylists ids: %s", items_id)
-
-    search_query = (
-        select(PlaylistModel)
-        .where(PlaylistModel.service == "soundcloud")
-        .where(PlaylistModel.platform_id.in_(items_id))  # type: ignore
+    tracks_statement = keyset_page(
+        tracks_statement.where(TrackModel.playlists.any(id=id)),  # type: ignore
+        TrackModel.id,
+        cursor,
+        limit,
     )
-    search_result = orm.exec(search_query).fetchall()
-
-    lookup_objs = {obj.platform_id: obj for obj in search_result}
-    updated_items = []
-    created_items = []
-
-    for obj in res:
-        item = lookup_objs.get(str(obj.platform_id))
-        if item:
-            item.update_from_schema(obj)
-            updated_items.append(item)
-        else:
-            new_item = PlaylistModel.from_schema(obj)
-            new_item.service = "soundcloud"
-            orm.add(new_item)
-            created_items.append(new_item)
+    tracks, next_cursor = split_page(
+        (await orm.exec(tracks_statement)).fetchall(), limit
+    )
+    headers = page_headers(request, next_cursor)
+
+    if projection:
+        items = []
+        for track in tracks:
+            item = track._asdict()
+            if "stream_url" in projection:
+                item["stream_url"] = str(
+                    request.url_for("play-track", track_id=track.id)
+                )
+            items.append(item)
+        return projection_response(items, headers)
+    response.headers.update(headers)
+    return [track.to_public_model(request) for track in tracks]
 
-    orm.commit()
 
-    return {
-        "updated_playlists": len(updated_items),
-        "created_playlists": len(created_items),
-        "total": len(res),
-    }
+@router.post(
+    "/sync/", response_model=SyncJobReport, status_code=status.HTTP_202_ACCEPTED
+)
+async def sync_playlists(request: Request):
+    return request.app.state.sync_manager.sync_library()
 
 
-@router.post("/{id}/sync/")
+@router.post(
+    "/{id}/sync/", response_model=SyncJobReport, status_code=status.HTTP_202_ACCEPTED
+)
 async def sync_playlist_tracks(
-    id: Annotated[int, Path(title="ID or playlist")], orm: SessionDep
+    id: Annotated[int, Path(title="ID or playlist")],
+    orm: AsyncSessionDep,
+    request: Request,
+    full: Annotated[
+        bool,
+        Query(description="Sync an unchanged playlist and refetch every track"),
+    ] = False,
 ):
     playlist_obj_statement = select(PlaylistModel).where(PlaylistModel.id == id)
-    playlist_obj = orm.exec(playlist_obj_statement).one_or_none()
+    playlist_obj = (await orm.exec(playlist_obj_statement)).one_or_none()
     if not playlist_obj:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Playlist Not Found"
@@ -110,53 +137,44 @@ async def sync_playlist_tracks(
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="This Playlist Is Offline"
         )
-    settings_query = select(SettingsModel)
-    settings = orm.exec(settings_query).one_or_none()
-    async with ClientSession(settings=settings) as session:
-        client_id = await get_client_id(session)
-        app_version = await get_app_version(session)
-        sc_auth = SoundCloudAuth(
-            client_id,
-            app_version,
-            oauth=settings.get_soundcloud_oauth()
-            if settings
-            else config.settings.soundcloud_oauth,
-        )
-        res = await get_playlist_tracks(playlist_obj.url, session, sc_auth)
 
-    created_tracks = []
-    updated_tracks = []
+    return request.app.state.sync_manager.sync_playlist(id, full)
 
-    tracks_ids = {obj.platform_id for obj in res}
 
-    tracks_statement = select(TrackModel).where(
-        or_(TrackModel.playlists.any(id=id), TrackModel.platform_id.in_(tracks_ids))  # type: ignore
-    )
-    tracks = orm.exec(tracks_statement).fetchall()
-
-    tracks_objs_lookup_ids = {obj.platform_id: obj for obj in tracks}
-    for obj in res:
-        item = tracks_objs_lookup_ids.get(obj.platform_id)
-
-        if item and item.platform_id not in tracks_ids:
-            item.playlists.remove(playlist_obj)
-            updated_tracks.append(item)
-        elif item and playlist_obj in item.playlists:
-            continue
-        elif item and playlist_obj not in item.playlists:
-            item.playlists.append(playlist_obj)
-            updated_tracks.append(item)
-        else:
-            new_item = TrackModel.from_schema(obj)
-            new_item.playlists = [playlist_obj]
-            orm.add(new_item)
-            created_tracks.append(new_item)
-
-    orm.commit()
-
-    return {
-        "created_tracks": len(created_tracks),
-        "updated_tracks": len(updated_tracks),
-        "unchanged_tracks": len(tracks) - (len(created_tracks) + len(updated_tracks)),
-        "total": len(tracks),
-    }
+@router.get("/sync/jobs/", response_model=list[SyncJobReport])
+async def sync_jobs(request: Request):
+    return list(request.app.state.sync_manager.jobs.values())
+
+
+@router.get("/sync/jobs/{job_id:int}/", response_model=SyncJobReport)
+async def sync_job(job_id: int, request: Request):
+    job = request.app.state.sync_manager.jobs.get(job_id)
+    if not job:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Sync Job Not Found")
+    return job
+
+
+@router.post("/sync/jobs/{job_id:int}/cancel/", response_model=SyncJobReport)
+async def cancel_sync_job(job_id: int, request: Request):
+    sync_manager: SyncManager = request.app.state.sync_manager
+    job = sync_manager.jobs.get(job_id)
+    if not job:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Sync Job Not Found")
+    if not sync_manager.cancel(job_id):
+        raise HTTPException(status.HTTP_409_CONFLICT, "Sync Job Already Finished")
+    await sync_manager.wait(job)
+    return job
+
+
+@router.get("/sync/jobs/progress-reports/")
+async def sync_jobs_progress_reports(request: Request):
+    """A `snapshot` event with every job first, then messages with only the
+    jobs that changed, pruned jobs as null"""
+    sync_manager: SyncManager = request.app.state.sync_manager
+
+    async def progress_generator():
+        with sync_manager.progress_hub.subscribe() as subscriber:
+            while not await request.is_disconnected():
+                yield await subscriber.get()
+
+    return StreamingResponse(progress_generator(), media_type="text/event-stream")
@@ -1,7 +1,8 @@
 from fastapi import HTTPException, Request, status
 from fastapi.routing import APIRouter
 from sqlmodel import select
-from app.core.db import SessionDep
+from app.core.db import AsyncSessionDep
+from app.http.session import SharedClientSession
 from app.models.settings import (
     SettingsModel,
     SettingsPublicModel,
@@ -12,9 +13,9 @@ router = APIRouter(prefix="/settings")
 
 
 @router.get("/", response_model=SettingsPublicModel)
-async def get_settings(orm: SessionDep):
+async def get_settings(orm: AsyncSessionDep):
     query = select(SettingsModel)
-    setting = orm.exec(query).one_or_none()
+    setting = (await orm.exec(query)).one_or_none()
     if not setting:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
@@ -23,21 +24,24 @@ async def get_settings(orm: SessionDep):
 
 @router.patch("/", response_model=SettingsPublicModel)
 async def update_settings(
-    settings_data: SettingsUpdateModel, orm: SessionDep, request: Request
+    settings_data: SettingsUpdateModel, orm: AsyncSessionDep, request: Request
 ):
     validated_settings_data = SettingsUpdateModel.model_validate(settings_data)
     query = select(SettingsModel)
-    setting = orm.exec(query).one_or_none()
+    setting = (await orm.exec(query)).one_or_none()
     if not setting:
         setting = SettingsModel(**validated_settings_data.model_dump())
         orm.add(setting)
     else:
         setting.sqlmodel_update(validated_settings_data.model_dump())
         orm.add(setting)
-    orm.commit()
-
-    await request.app.state.downloader.semaphore.update_limit(
-        setting.concurrent_downloads
-    )
+    await orm.commit()
+
+    request.app.state.downloader.resize(setting.concurrent_downloads)
+    # proxy, headers and cookies are bound to the pooled session, its
+    # connections are kept unless they change
+    http_client: SharedClientSession = request.app.state.http_client
+    if http_client.session_key != http_client.get_session_key(setting):
+        await http_client.rebuild(setting)
 
     return setting
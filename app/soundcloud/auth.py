@@ -1,8 +1,14 @@
 import asyncio
+from datetime import datetime, timedelta
+from collections.abc import Awaitable, Callable
 import aiohttp
 from aiohttp import ClientSession
+from sqlmodel import select
 from app.core import config
+from app.core.db import new_async_session
 from app.core.logging import get_logger
+from app.models.settings import SoundCloudCredentialsModel
+from app.soundcloud.response import loads, preview
 
 import re
 import dataclasses
@@ -10,6 +16,13 @@ import dataclasses
 logger = get_logger(__name__)
 
 
+class SoundCloudAuthError(Exception):
+    """api-v2 rejected the request with 401/403"""
+
+    def __init__(self, url: str, status: int) -> None:
+        super().__init__(f"SoundCloud rejected {url} with status {status}")
+        self.url = url
+        self.status = status
 
 
 @dataclasses.dataclass
@@ -28,7 +41,7 @@ class SoundCloudAuth:
 async def get_client_id(session: ClientSession) -> str:
 
     home_page_url: str = "https://soundcloud.com/"
-    regex_client_id: str = r'"id"\s*:\s*"([^"]+)"'
+    regex_client_id: bytes = rb'"id"\s*:\s*"([^"]+)"'
     timeout = aiohttp.ClientTimeout(10)
     logger.info("request to %s with timeout=%d", home_page_url, timeout.total)
     try:
@@ -36,11 +49,11 @@ async def get_client_id(session: ClientSession) -> str:
             home_page_url,
             timeout=timeout,
         ) as req:
-            html = await req.text()
-            logger.info("Homepage status %d length %d", req.status, len(html))
+            html = await req.read()
+            logger.info("Homepage status %d bytes %d", req.status, len(html))
 
             if req.status != 200:
-                logger.error("non-200 status html[2000]:%s", html[:2000])
+                logger.error("non-200 status html[2000]:%s", preview(html))
                 return ""
 
             logger.info("search for client ID on homepage")
@@ -49,7 +62,7 @@ async def get_client_id(session: ClientSession) -> str:
                 html,
             )
             if target_math:
-                client_id: str = target_math.group(1)
+                client_id: str = target_math.group(1).decode()
                 logger.info("Client ID matched : %s", client_id)
             else:
                 client_id = ""
@@ -67,15 +80,115 @@ async def get_app_version(session: ClientSession) -> str:
     url: str = "https://soundcloud.com/versions.json"
     logger.info("requesting %s", url)
     async with session.get(url) as req:
-        html = await req.text()
-        json = await req.json()
-        logger.info("Versions Page status %d length %d", req.status, len(html))
+        html = await req.read()
+        logger.info("Versions Page status %d bytes %d", req.status, len(html))
+        json = loads(html)
         version = json.get("app")
         logger.info("App Version is %s", version or "NotFound")
         if not version:
-            logger.error("Version NotFound data: %s", html)
+            logger.error("Version NotFound data: %s", preview(html))
 
     return version
 
 
 async def get_track_authorization() -> str: ...
+
+
+class CredentialsCache:
+    """`client_id`/`app_version` shared by every sync until `ttl` expires.
+
+    Refreshing is single-flight: concurrent callers wait on the lock and reuse
+    the result of the first fetch. The last credentials are persisted so a
+    restart doesn't need to scrape the homepage again.
+    """
+
+    def __init__(self, ttl: int) -> None:
+        self.ttl = timedelta(seconds=ttl)
+        self.client_id = ""
+        self.app_version = ""
+        self.fetched_at = datetime.min
+        self.loaded = False
+        self._lock = asyncio.Lock()
+
+    def is_fresh(self) -> bool:
+        return bool(
+            self.client_id
+            and self.app_version
+            and datetime.now() - self.fetched_at < self.ttl
+        )
+
+    def invalidate(self, client_id: str) -> None:
+        # another caller may have refreshed already
+        if client_id == self.client_id:
+            logger.info("invalidate SoundCloud credentials client_id %s", client_id)
+            self.fetched_at = datetime.min
+
+    async def get(self, session: ClientSession) -> tuple[str, str]:
+        if self.is_fresh():
+            return self.client_id, self.app_version
+
+        async with self._lock:
+            if not self.loaded:
+                await self.load()
+            if self.is_fresh():
+                return self.client_id, self.app_version
+
+            client_id = await get_client_id(session)
+            app_version = await get_app_version(session)
+            if client_id and app_version:
+                self.client_id = client_id
+                self.app_version = app_version
+                self.fetched_at = datetime.now()
+                await self.save()
+            return client_id, app_version
+
+    async def load(self) -> None:
+        self.loaded = True
+        async with new_async_session() as orm:
+            query = select(SoundCloudCredentialsModel)
+            credentials = (await orm.exec(query)).first()
+        if credentials:
+            self.client_id = credentials.client_id
+            self.app_version = credentials.app_version
+            self.fetched_at = credentials.fetched_at
+            logger.info("loaded SoundCloud credentials from database")
+
+    async def save(self) -> None:
+        async with new_async_session() as orm:
+            query = select(SoundCloudCredentialsModel)
+            credentials = (await orm.exec(query)).first()
+            if not credentials:
+                credentials = SoundCloudCredentialsModel(
+                    client_id=self.client_id,
+                    app_version=self.app_version,
+                    fetched_at=self.fetched_at,
+                )
+            else:
+                credentials.client_id = self.client_id
+                credentials.app_version = self.app_version
+                credentials.fetched_at = self.fetched_at
+            orm.add(credentials)
+            await orm.commit()
+
+
+credentials_cache = CredentialsCache(config.settings.soundcloud_credentials_ttl)
+
+
+async def get_soundcloud_auth(session: ClientSession, oauth: str) -> SoundCloudAuth:
+    client_id, app_version = await credentials_cache.get(session)
+    return SoundCloudAuth(client_id=client_id, app_version=app_version, oauth=oauth)
+
+
+async def call_with_auth[T](
+    session: ClientSession, oauth: str, call: Callable[[SoundCloudAuth], Awaitable[T]]
+) -> T:
+    """Run `call` with cached credentials, on 401/403 the credentials are
+    refreshed and `call` is retried once"""
+    sc_auth = await get_soundcloud_auth(session, oauth)
+    try:
+        return await call(sc_auth)
+    except SoundCloudAuthError as error:
+        logger.warning("%s, refreshing credentials and retrying", error)
+        credentials_cache.invalidate(sc_auth.client_id)
+        sc_auth = await get_soundcloud_auth(session, oauth)
+        return await call(sc_auth)
@@ -2,10 +2,21 @@
 from app.core.logging import get_logger
 from app.core import config
 import asyncio
+from concurrent.futures import Executor
+from contextlib import AbstractContextManager, nullcontext
+import multiprocessing
+from multiprocessing.connection import Connection
+import threading
+from collections.abc import Callable
 import yt_dlp
+from app.download_manager.bandwidth import ApplyRateLimit, BandwidthBudget
 
 logger = get_logger(__name__)
 
+# progress fields sent back by a download process, `info_dict` and the
+# like are neither needed nor picklable
+PROGRESS_TYPES = (str, int, float, type(None))
+
 
 def sync_download_ytdl(links: list[str], config) -> tuple[bool, Exception | None]:
     with yt_dlp.YoutubeDL(config) as ydl:
@@ -17,6 +28,234 @@ def sync_download_ytdl(links: list[str], config) -> tuple[bool, Exception | None
     return True, None
 
 
+async def download_ytdl(
+    links: list[str],
+    ydl_config: dict,
+    executor: Executor | None = None,
+    bandwidth: BandwidthBudget | None = None,
+) -> tuple[bool, Exception | None]:
+    """Download with the `download_backend` setting, a download in a process
+    is killed as soon as it's canceled, one in a thread only stops on its
+    next progress hook. Blocking calls run on `executor` and the rate limit
+    follows the `bandwidth` share of the download."""
+    if config.settings.download_backend == "process":
+        return await ytdl_process_pool.download(links, ydl_config, executor, bandwidth)
+
+    def apply(ratelimit: int | None):
+        # yt-dlp reads the limit from this same dict while downloading
+        ydl_config["ratelimit"] = ratelimit
+
+    with rate_limited(bandwidth, apply):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, sync_download_ytdl, links, ydl_config
+        )
+
+
+def rate_limited(
+    bandwidth: BandwidthBudget | None, apply: ApplyRateLimit
+) -> AbstractContextManager:
+    return bandwidth.job(apply) if bandwidth else nullcontext()
+
+
+class PipeLogger:
+    def __init__(self, send: Callable[[tuple], None]) -> None:
+        self.send = send
+
+    def debug(self, msg): ...
+
+    def info(self, msg):
+        pass
+
+    def warning(self, msg):
+        pass
+
+    def error(self, msg):
+        self.send(("log", msg))
+
+
+def process_main(conn: Connection):
+    """Entry point of a download process, runs one download at a time until
+    the pipe is closed. The download runs in a thread, this one reads the
+    rate limit updates meanwhile."""
+    send_lock = threading.Lock()
+
+    def send(message: tuple):
+        with send_lock:
+            conn.send(message)
+
+    def hook(progress: dict):
+        send(
+            (
+                "progress",
+                {k: v for k, v in progress.items() if isinstance(v, PROGRESS_TYPES)},
+            )
+        )
+
+    def download(links: list[str], ydl_config: dict, results: list[str | None]):
+        try:
+            with yt_dlp.YoutubeDL(ydl_config) as ydl:
+                ydl.download(links)
+            results.append(None)
+        except yt_dlp.utils.YoutubeDLError as err:
+            results.append(repr(err))
+
+    while True:
+        try:
+            kind, payload = conn.recv()
+        except EOFError:
+            return
+        if kind != "download":
+            # rate limit sent while the previous download was ending
+            continue
+        links, ydl_config = payload
+        ydl_config["progress_hooks"] = [hook]
+        ydl_config["logger"] = PipeLogger(send)
+        # no result when the thread died on an unexpected error
+        results: list[str | None] = []
+        thread = threading.Thread(
+            target=download, args=(links, ydl_config, results), daemon=True
+        )
+        thread.start()
+        while thread.is_alive():
+            if not conn.poll(0.2):
+                continue
+            try:
+                kind, payload = conn.recv()
+            except EOFError:
+                return
+            if kind == "ratelimit":
+                ydl_config["ratelimit"] = payload
+        send(("done", results[0] if results else "Download Thread Crashed"))
+
+
+class YtdlProcess:
+    def __init__(self, context) -> None:
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=process_main, args=(child_conn,), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.killed = False
+        self.running = False
+        self.ratelimit: int | None = None
+        self.send_lock = threading.Lock()
+
+    def run(self, links: list[str], ydl_config: dict) -> tuple[bool, Exception | None]:
+        """Blocking, hooks and logger of `ydl_config` are called in this
+        thread with what the process sends back"""
+        ydl_config = ydl_config.copy()
+        hooks = ydl_config.pop("progress_hooks", [])
+        ydl_logger = ydl_config.pop("logger", None)
+        with self.send_lock:
+            ydl_config["ratelimit"] = self.ratelimit
+            self.conn.send(("download", (links, ydl_config)))
+            self.running = True
+        try:
+            return self._relay(links, hooks, ydl_logger)
+        finally:
+            with self.send_lock:
+                self.running = False
+
+    def _relay(
+        self, links: list[str], hooks: list, ydl_logger
+    ) -> tuple[bool, Exception | None]:
+        while True:
+            try:
+                kind, payload = self.conn.recv()
+            except (EOFError, OSError) as err:
+                if not self.killed:
+                    logger.error("Download Process Of %s Exited", links)
+                return False, err
+            if kind == "progress":
+                for hook in hooks:
+                    hook(payload)
+            elif kind == "log":
+                if ydl_logger:
+                    ydl_logger.error(payload)
+            elif payload:
+                logger.error("Error While Downloading %s File Via ydl", links)
+                return False, Exception(payload)
+            else:
+                return True, None
+
+    def set_ratelimit(self, ratelimit: int | None):
+        with self.send_lock:
+            self.ratelimit = ratelimit
+            if self.running and not self.killed:
+                self.conn.send(("ratelimit", ratelimit))
+
+    def kill(self):
+        # the relay thread gets EOF on its pipe once the process is gone
+        self.killed = True
+        self.process.kill()
+
+    def is_reusable(self) -> bool:
+        return not self.killed and self.process.is_alive()
+
+
+class YtdlProcessPool:
+    """yt-dlp download processes, out of the GIL of the api event loop.
+
+    A process runs one download at a time and is kept for the next one, up to
+    `max_idle` idle processes. A canceled download kills its process.
+    """
+
+    def __init__(self, max_idle: int) -> None:
+        self.max_idle = max_idle
+        # forking a process with running threads isn't safe
+        self.context = multiprocessing.get_context("spawn")
+        self.idle: list[YtdlProcess] = []
+        self.lock = threading.Lock()
+
+    def acquire(self) -> YtdlProcess:
+        with self.lock:
+            while self.idle:
+                process = self.idle.pop()
+                if process.is_reusable():
+                    return process
+        return YtdlProcess(self.context)
+
+    def release(self, process: YtdlProcess):
+        with self.lock:
+            if process.is_reusable() and len(self.idle) < self.max_idle:
+                self.idle.append(process)
+                return
+        if not process.killed:
+            process.kill()
+
+    async def download(
+        self,
+        links: list[str],
+        ydl_config: dict,
+        executor: Executor | None = None,
+        bandwidth: BandwidthBudget | None = None,
+    ) -> tuple[bool, Exception | None]:
+        loop = asyncio.get_running_loop()
+        process = await loop.run_in_executor(executor, self.acquire)
+        try:
+            with rate_limited(bandwidth, process.set_ratelimit):
+                return await loop.run_in_executor(
+                    executor, process.run, links, ydl_config
+                )
+        except BaseException:
+            # canceled, or a hook raised, the download may be stuck in a read
+            process.kill()
+            raise
+        finally:
+            self.release(process)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for process in idle:
+            process.kill()
+
+
+ytdl_process_pool = YtdlProcessPool(config.settings.download_idle_processes)
+
+
 async def download_tracks(
     track_urls: list[str],
 ) -> None:
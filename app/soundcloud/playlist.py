@@ -1,5 +1,10 @@
+import asyncio
+from collections.abc import Callable
+from app.core import config
 from app.core.logging import get_logger
-from app.soundcloud.auth import SoundCloudAuth
+from app.soundcloud.auth import SoundCloudAuth, SoundCloudAuthError
+from app.soundcloud.response import CollectionPage, loads, preview
+import aiohttp
 from aiohttp import ClientSession
 import re
 from datetime import datetime
@@ -7,70 +12,122 @@ from app.schemas.playlist import PlaylistSchema, TrackSchema
 
 logger = get_logger(__name__)
 
+# stale client_id, retrying with the same credentials won't help
+AUTH_ERROR_STATUSES = (401, 403)
+
+
+def with_auth_params(next_href: str, sc_auth: SoundCloudAuth) -> str:
+    """`next_href` of paginated apis doesn't always carry the auth params"""
+    if "client_id=" in next_href:
+        return next_href
+    separator = "&" if "?" in next_href else "?"
+    return (
+        f"{next_href}{separator}client_id={sc_auth.client_id}"
+        f"&app_version={sc_auth.app_version}"
+        "&app_locale=en"
+    )
+
 
 async def get_playlists(
-    session: ClientSession, sc_auth: SoundCloudAuth, limit: int = 100
+    session: ClientSession,
+    sc_auth: SoundCloudAuth,
+    limit: int = 100,
+    concurrency: int = config.settings.soundcloud_concurrent_requests,
 ) -> list[PlaylistSchema]:
-    url = (
+    url: str | None = (
         "https://api-v2.soundcloud.com/me/library/all?"
-        # "offset=2022-01-15T13%3A44%3A17.936Z"
-        # "%2Csystem-playlist-like"
-        # "%2C00000000000038985529"
         f"&limit={limit}"
         f"&client_id={sc_auth.client_id}"
         f"&app_version={sc_auth.app_version}"
         "&app_locale=en"
     )
-    logger.info("Requesting url %s", url)
-    playlists: list[PlaylistSchema] = []
+    # fallbacks are resolved in the background while next pages are fetched,
+    # their slot keeps the library order
+    playlists: list[PlaylistSchema | asyncio.Task] = []
     checked = set()
-    async with session.get(url) as req:
-        content = await req.text()
-        logger.info("User playlists api status %d length %d", req.status, len(content))
-        if req.status != 200:
-            logger.error(
-                "Non-200 response from url %s content[2000]: %s", url, content[:2000]
-            )
-            return []
-        data: dict = await req.json()
-        collections: list[dict] = data.get("collection", {})
-
-        for collection in collections:
-            collection: dict
-            playlist: dict = collection.get(
-                "playlist",
-                # fallback
-                collection.get("system_playlist", {}),
-            )
-            user = playlist.get("user", {}).get("full_name")
-            platform_id = str(playlist.get("id", -1))
-
-            # prevent duplicated from API
-            if platform_id in checked:
-                continue
-            checked.add(platform_id)
-            if playlist.get("artwork_url"):
-                obj = PlaylistSchema(
-                    platform_id=platform_id,
-                    duration=playlist.get("duration", 0),
-                    is_synced=False,
-                    last_modified=playlist.get("last_modified", datetime.now()),
-                    name=playlist.get("title", "Unknown"),
-                    owner=playlist.get("user", {}).get("full_name", None)
-                    or user
-                    or "Unknown",
-                    track_count=playlist.get("track_count", 0)
-                    or len(playlist.get("tracks", [])),
-                    url=playlist.get("permalink_url", ""),
-                    thumbnail=playlist.get("artwork_url"),
-                )
-                playlists.append(obj)
-            else:
-                obj = await get_playlist(platform_id, session, sc_auth)
-                playlists.append(obj)  # type: ignore
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_playlist(platform_id: str) -> PlaylistSchema | None:
+        async with semaphore:
+            return await get_playlist(platform_id, session, sc_auth)
+
+    try:
+        while url:
+            logger.info("Requesting url %s", url)
+            async with session.get(url) as req:
+                logger.info("User playlists api status %d", req.status)
+                if req.status in AUTH_ERROR_STATUSES:
+                    raise SoundCloudAuthError(url, req.status)
+                if req.status != 200:
+                    content = await req.read()
+                    logger.error(
+                        "Non-200 response from url %s bytes %d content[2000]: %s",
+                        url,
+                        len(content),
+                        preview(content),
+                    )
+                    break
+
+                page = CollectionPage(req)
+                async for collection in page:
+                    playlist: dict = collection.get(
+                        "playlist",
+                        # fallback
+                        collection.get("system_playlist", {}),
+                    )
+                    user = playlist.get("user", {}).get("full_name")
+                    platform_id = str(playlist.get("id", -1))
+
+                    # prevent duplicated from API
+                    if platform_id in checked:
+                        continue
+                    checked.add(platform_id)
+                    if playlist.get("artwork_url"):
+                        obj = PlaylistSchema(
+                            platform_id=platform_id,
+                            duration=playlist.get("duration", 0),
+                            is_synced=False,
+                            last_modified=playlist.get("last_modified", datetime.now()),
+                            name=playlist.get("title", "Unknown"),
+                            owner=playlist.get("user", {}).get("full_name", None)
+                            or user
+                            or "Unknown",
+                            track_count=playlist.get("track_count", 0)
+                            or len(playlist.get("tracks", [])),
+                            url=playlist.get("permalink_url", ""),
+                            thumbnail=playlist.get("artwork_url"),
+                        )
+                        playlists.append(obj)
+                    else:
+                        playlists.append(
+                            asyncio.create_task(fetch_playlist(platform_id))
+                        )
+
+            next_href: str | None = page.fields.get("next_href")
+            url = with_auth_params(next_href, sc_auth) if next_href else None
 
-    logger.info("Extracted playlists total %d", len(playlists))
-    return playlists
+            if url:
+                logger.info("Paginate to next page %s", url)
+
+        pending = [item for item in playlists if isinstance(item, asyncio.Task)]
+        logger.info("Waiting for fallback playlists total %d", len(pending))
+        await asyncio.gather(*pending)
+    except BaseException:
+        pending = [item for item in playlists if isinstance(item, asyncio.Task)]
+        for task in pending:
+            task.cancel()
+        # retrieves the errors of the other failed fallbacks
+        await asyncio.gather(*pending, return_exceptions=True)
+        raise
+
+    results: list[PlaylistSchema] = []
+    for item in playlists:
+        obj = item.result() if isinstance(item, asyncio.Task) else item
+        if obj:
+            results.append(obj)
+
+    logger.info("Extracted playlists total %d", len(results))
+    return results
 
 
 async def get_playlist(
@@ -87,14 +144,16 @@ async def get_playlist(
     logger.info("requesting playlist %s url %s", id, url)
 
     async with session.get(url) as req:
-        content = await req.text()
-        logger.info("User playlist api status %d length %d", req.status, len(content))
+        content = await req.read()
+        logger.info("User playlist api status %d bytes %d", req.status, len(content))
+        if req.status in AUTH_ERROR_STATUSES:
+            raise SoundCloudAuthError(url, req.status)
         if req.status != 200:
             logger.error(
-                "Non-200 response from url %s content[2000]: %s", url, content[:2000]
+                "Non-200 response from url %s content[2000]: %s", url, preview(content)
             )
             return None
-        playlist: dict = await req.json()
+        playlist: dict = loads(content)
 
         user = playlist.get("user", {}).get("full_name")
         tracks = playlist.get("tracks", [])
@@ -132,24 +191,23 @@ async def get_liked_tracks(
     liked_tracks: list[dict] = []
     while url:
         async with session.get(url) as req:
-            content = await req.text()
-            logger.info(
-                "track likes Api response status %d length %d", req.status, len(content)
-            )
+            logger.info("track likes Api response status %d", req.status)
+            if req.status in AUTH_ERROR_STATUSES:
+                raise SoundCloudAuthError(url, req.status)
 
             if req.status != 200:
+                content = await req.read()
                 logger.error(
                     "Non-200 Response status %d content[2000]: %s",
                     req.status,
-                    content[:2000],
+                    preview(content),
                 )
                 return []
 
-            data: dict = await req.json()
-            tracks: list[dict] = data.get("collection", [])
-            url: str | None = data.get("next_href")
-
-            liked_tracks.extend(tracks)
+            page = CollectionPage(req)
+            async for track in page:
+                liked_tracks.append(track)
+            url: str | None = page.fields.get("next_href")
 
             if url:
                 logger.info("Paginate to next page %s", url)
@@ -164,64 +222,105 @@ async def get_playlist_tracks_ids(
     session: ClientSession,
 ) -> list[str]:
     logger.info("request playlist page %s", playlist_uri)
-    track_ids_regex = r'"id"\s*:\s*(\d+)\s*,\s*"kind"\s*:\s*"track"'
+    # matched on the raw bytes, the page is never decoded to a string
+    track_ids_regex = rb'"id"\s*:\s*(\d+)\s*,\s*"kind"\s*:\s*"track"'
 
     async with session.get(playlist_uri) as req:
-        content = await req.text()
+        content = await req.read()
         logger.info(
-            "playlist page response status %d length %d", req.status, len(content)
+            "playlist page response status %d bytes %d", req.status, len(content)
         )
         if req.status != 200:
             logger.error(
                 "Non-200 response status %d content[2000]: %s",
                 req.status,
-                content[:2000],
+                preview(content),
             )
             return []
-        tracks_ids: list[str] = re.findall(track_ids_regex, content)
+        tracks_ids: list[str] = [
+            track_id.decode() for track_id in re.findall(track_ids_regex, content)
+        ]
         logger.info("extracted playlist tracks IDs total %d", len(tracks_ids))
         logger.debug("extracted track ids : %s", tracks_ids)
     return tracks_ids
 
 
-async def get_playlist_tracks(
-    playlist_uri: str,
+async def get_tracks_batch(
+    ids_query: str,
+    session: ClientSession,
+    sc_auth: SoundCloudAuth,
+    retries: int = config.settings.soundcloud_request_retries,
+) -> list[dict]:
+    url = (
+        "https://api-v2.soundcloud.com/tracks?"
+        f"ids={ids_query}"
+        f"&client_id={sc_auth.client_id}"
+        f"&app_version={sc_auth.app_version}"
+        "&app_locale=en"
+    )
+    for attempt in range(1, retries + 1):
+        logger.info("requesting tracks api via url %s attempt %d", url, attempt)
+        try:
+            async with session.get(url) as req:
+                content = await req.read()
+                logger.info(
+                    "tracks api response status %d bytes %d", req.status, len(content)
+                )
+                if req.status == 200:
+                    return loads(content)
+                if req.status in AUTH_ERROR_STATUSES:
+                    raise SoundCloudAuthError(url, req.status)
+                logger.error(
+                    "error on tracks api with status %d content[2000] %s",
+                    req.status,
+                    preview(content),
+                )
+        except (aiohttp.ClientError, TimeoutError) as error:
+            logger.error("error on requesting tracks api: %s", error)
+        # back off a little more on every failed attempt
+        if attempt < retries:
+            await asyncio.sleep(attempt)
+
+    logger.error("tracks api batch failed after %d attempts url %s", retries, url)
+    return []
+
+
+async def get_tracks(
+    tracks_ids: list[str],
     session: ClientSession,
     sc_auth: SoundCloudAuth,
     batch_size_tracks_ids: int = 29,
+    concurrency: int = config.settings.soundcloud_concurrent_requests,
+    on_batch: Callable[[int], None] | None = None,
 ) -> list[TrackSchema]:
-
-    tracks_ids = await get_playlist_tracks_ids(playlist_uri, session)
+    """Tracks data of `tracks_ids`, in the same order. `on_batch` is called
+    with the ids count of every finished batch"""
     id_query_batch = []
-    tracks_data: list[dict] = []
 
     for i in range(0, len(tracks_ids), batch_size_tracks_ids):
         ids_query = "%2C".join(tracks_ids[i : i + batch_size_tracks_ids])
         id_query_batch.append(ids_query)
 
-    for ids_query in id_query_batch:
-        url = (
-            "https://api-v2.soundcloud.com/tracks?"
-            f"ids={ids_query}"
-            f"&client_id={sc_auth.client_id}"
-            f"&app_version={sc_auth.app_version}"
-            "&app_locale=en"
-        )
-        logger.info("requesting tracks api via url %s ", url)
-        async with session.get(url) as req:
-            content = await req.text()
-            logger.info(
-                "tracks api response status %d length %d", req.status, len(content)
-            )
-            if req.status != 200:
-                logger.error(
-                    "error on tracks api with status %d content[2000] %s",
-                    req.status,
-                    content[:2000],
-                )
-                return []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_batch(ids_query: str) -> list[dict]:
+        async with semaphore:
+            batch = await get_tracks_batch(ids_query, session, sc_auth)
+        if on_batch:
+            on_batch(ids_query.count("%2C") + 1)
+        return batch
 
-            tracks_data.extend(await req.json())
+    batches = await asyncio.gather(
+        *[fetch_batch(ids_query) for ids_query in id_query_batch]
+    )
+
+    # api doesn't keep the requested order, restore the playlist order
+    tracks_lookup = {
+        str(data.get("id", 0)): data for batch in batches for data in batch
+    }
+    tracks_data: list[dict] = [
+        tracks_lookup[track_id] for track_id in tracks_ids if track_id in tracks_lookup
+    ]
 
     objects = []
     for data in tracks_data:
@@ -239,4 +338,17 @@ async def get_playlist_tracks(
 
     logger.info("extracted tracks data total %d", len(tracks_data))
 
-    return objects
\ No newline at end of file
+    return objects
+
+
+async def get_playlist_tracks(
+    playlist_uri: str,
+    session: ClientSession,
+    sc_auth: SoundCloudAuth,
+    batch_size_tracks_ids: int = 29,
+    concurrency: int = config.settings.soundcloud_concurrent_requests,
+) -> list[TrackSchema]:
+    tracks_ids = await get_playlist_tracks_ids(playlist_uri, session)
+    return await get_tracks(
+        tracks_ids, session, sc_auth, batch_size_tracks_ids, concurrency
+    )
@@ -0,0 +1,140 @@
+import codecs
+import json
+from collections.abc import AsyncIterator
+from typing import Any
+
+from aiohttp import ClientResponse
+
+from app.core import config
+from app.core.logging import get_logger
+
+try:
+    import orjson
+except ImportError:  # optional, stdlib json is the fallback
+    orjson = None
+
+logger = get_logger(__name__)
+
+decoder = json.JSONDecoder()
+WHITESPACE = " \t\n\r"
+
+
+def loads(body: bytes) -> Any:
+    if orjson:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def preview(body: bytes, size: int = 2000) -> str:
+    """first `size` bytes of a body for error logs"""
+    return body[:size].decode("utf-8", errors="replace")
+
+
+class CollectionPage:
+    """Items of a paginated api-v2 response (`{"collection": [...], ...}`).
+
+    With `stream` the `collection` array is parsed item by item while the body
+    is still downloading, so big pages don't need to be buffered and decoded in
+    one go. The other top level fields (`next_href`, ...) are available in
+    `fields` once the items are consumed.
+    """
+
+    def __init__(
+        self,
+        resp: ClientResponse,
+        key: str = "collection",
+        stream: bool = config.settings.soundcloud_stream_json,
+        chunk_size: int = 256 * 1024,
+    ) -> None:
+        self.resp = resp
+        self.key = key
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.fields: dict[str, Any] = {}
+        self.size = 0
+
+    def __aiter__(self) -> AsyncIterator[dict]:
+        if self.stream:
+            return self._iter_stream()
+        return self._iter_body()
+
+    async def _iter_body(self) -> AsyncIterator[dict]:
+        body = await self.resp.read()
+        self.size = len(body)
+        data: dict = loads(body)
+        items: list[dict] = data.pop(self.key, None) or []
+        self.fields = data
+        logger.info("collection page bytes %d items %d", self.size, len(items))
+        for item in items:
+            yield item
+
+    async def _iter_stream(self) -> AsyncIterator[dict]:
+        # `"collection"` is assumed to be the first occurrence of the key,
+        # which holds for api-v2 where it is the first top level field
+        text_decoder = codecs.getincrementaldecoder("utf-8")()
+        token = f'"{self.key}"'
+        buffer = ""
+        head = ""
+        position = 0
+        in_array = False
+        done = False
+        count = 0
+        eof = False
+        chunks = self.resp.content.iter_chunked(self.chunk_size)
+
+        while not done:
+            try:
+                chunk = await anext(chunks)
+                self.size += len(chunk)
+                buffer += text_decoder.decode(chunk)
+            except StopAsyncIteration:
+                buffer += text_decoder.decode(b"", final=True)
+                eof = True
+
+            if not in_array:
+                start = buffer.find(token)
+                array_start = buffer.find("[", start) if start != -1 else -1
+                if array_start == -1:
+                    if eof:
+                        break
+                    continue
+                head = buffer[:start]
+                buffer = buffer[array_start + 1 :]
+                position = 0
+                in_array = True
+
+            while True:
+                while position < len(buffer) and buffer[position] in WHITESPACE + ",":
+                    position += 1
+                if position >= len(buffer):
+                    break
+                if buffer[position] == "]":
+                    done = True
+                    position += 1
+                    break
+                try:
+                    item, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    # item is still being downloaded
+                    break
+                count += 1
+                yield item
+
+            buffer = buffer[position:]
+            position = 0
+            if eof:
+                break
+
+        if not in_array:
+            # no collection at all, e.g. an error payload
+            self.fields = json.loads(buffer) if buffer.strip() else {}
+        else:
+            async for chunk in chunks:
+                self.size += len(chunk)
+                buffer += text_decoder.decode(chunk)
+            buffer += text_decoder.decode(b"", final=True)
+            self.fields = json.loads(f"{head}{json.dumps(self.key)}: []{buffer}")
+            self.fields.pop(self.key, None)
+        logger.info("collection page streamed bytes %d items %d", self.size, count)
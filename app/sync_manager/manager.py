@@ -0,0 +1,184 @@
+import asyncio
+import enum
+import itertools
+from datetime import datetime
+
+from pydantic import BaseModel
+
+from app.core.db import new_async_session
+from app.core.logging import get_logger
+from app.core.progress import ProgressHub
+from app.http.session import SharedClientSession
+from app.models.playlist import PlaylistModel
+from app.sync_manager.sync import (
+    PlaylistSyncError,
+    get_settings,
+    sync_library,
+    sync_playlist,
+)
+
+logger = get_logger(__name__)
+
+
+class SyncJobStatusEnum(str, enum.Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCESSFUL = "successful"
+    FAILED = "failed"
+    CANCELED = "canceled"
+
+
+class SyncJobReport(BaseModel):
+    id: int
+    playlist_id: int | None = None  # the library when None
+    full: bool = False
+    status: SyncJobStatusEnum = SyncJobStatusEnum.PENDING
+    done: int = 0
+    total: int = 0
+    result: dict | None = None
+    error: str | None = None
+    created_at: datetime
+    finished_at: datetime | None = None
+
+    @property
+    def is_finished(self) -> bool:
+        return self.finished_at is not None
+
+
+class SyncManager:
+    """Runs library/playlist syncs as background jobs.
+
+    A sync requested while the same library/playlist sync is pending or
+    running returns the existing job, a full sync upgrades a pending one or
+    runs after a running partial one. Only the last `max_finished_jobs`
+    finished jobs are kept.
+    """
+
+    def __init__(
+        self,
+        http_client: SharedClientSession,
+        concurrent_syncs: int,
+        max_finished_jobs: int,
+    ) -> None:
+        self.http_client = http_client
+        self.semaphore = asyncio.Semaphore(concurrent_syncs)
+        self.max_finished_jobs = max_finished_jobs
+        self.jobs: dict[int, SyncJobReport] = {}
+        self.tasks: dict[int, asyncio.Task] = {}
+        # playlist id (None for the library) -> id of its unfinished job
+        self.active_jobs: dict[int | None, int] = {}
+        self.progress_hub = ProgressHub(self.jobs)
+        self._ids = itertools.count(1)
+
+    def sync_library(self) -> SyncJobReport:
+        return self.submit(None)
+
+    def sync_playlist(self, playlist_id: int, full: bool = False) -> SyncJobReport:
+        return self.submit(playlist_id, full)
+
+    def submit(self, playlist_id: int | None, full: bool = False) -> SyncJobReport:
+        previous: asyncio.Task | None = None
+        job_id = self.active_jobs.get(playlist_id)
+        if job_id is not None:
+            active = self.jobs[job_id]
+            if not full or active.full:
+                logger.info("sync of %s already queued as job %d", playlist_id, job_id)
+                return active
+            if active.status == SyncJobStatusEnum.PENDING:
+                # `full` is read once the job runs
+                logger.info("sync job %d upgraded to a full sync", job_id)
+                active.full = True
+                self.progress_hub.notify()
+                return active
+            previous = self.tasks.get(job_id)
+
+        job = SyncJobReport(
+            id=next(self._ids),
+            playlist_id=playlist_id,
+            full=full,
+            created_at=datetime.now(),
+        )
+        self.jobs[job.id] = job
+        self.active_jobs[playlist_id] = job.id
+        task = asyncio.create_task(self.run(job, previous))
+        # a job canceled before it started never runs its own code
+        task.add_done_callback(lambda task: self.finish(job, task))
+        self.tasks[job.id] = task
+        self.prune()
+        self.progress_hub.notify()
+        return job
+
+    async def run(self, job: SyncJobReport, previous: asyncio.Task | None = None):
+        if previous:
+            # a partial sync of the same playlist is running
+            await asyncio.wait([previous])
+        async with self.semaphore:
+            job.status = SyncJobStatusEnum.RUNNING
+            self.progress_hub.notify()
+            job.result = await self.sync(job)
+
+    def finish(self, job: SyncJobReport, task: asyncio.Task):
+        if task.cancelled():
+            logger.info("sync job %d canceled", job.id)
+            job.status = SyncJobStatusEnum.CANCELED
+        elif error := task.exception():
+            logger.error("sync job %d failed: %r", job.id, error)
+            job.status = SyncJobStatusEnum.FAILED
+            job.error = str(error)
+        else:
+            job.status = SyncJobStatusEnum.SUCCESSFUL
+        job.finished_at = datetime.now()
+        if self.active_jobs.get(job.playlist_id) == job.id:
+            self.active_jobs.pop(job.playlist_id)
+        self.tasks.pop(job.id, None)
+        self.progress_hub.notify()
+
+    async def sync(self, job: SyncJobReport) -> dict:
+        async with new_async_session() as orm:
+            settings = await get_settings(orm)
+            session = await self.http_client.get(settings)
+            if job.playlist_id is None:
+                job.total = 1
+                result = await sync_library(orm, session, settings)
+                job.done = 1
+                return result
+
+            playlist_obj = await orm.get(PlaylistModel, job.playlist_id)
+            if not playlist_obj:
+                raise PlaylistSyncError("Playlist Not Found")
+
+            def progress(done: int, total: int):
+                job.done = done
+                job.total = total
+                self.progress_hub.notify()
+
+            return await sync_playlist(
+                orm, session, settings, playlist_obj, job.full, progress
+            )
+
+    async def wait(self, job: SyncJobReport) -> SyncJobReport:
+        task = self.tasks.get(job.id)
+        if task:
+            # cancelling the waiter doesn't cancel the job
+            await asyncio.wait([task])
+        return job
+
+    def cancel(self, job_id: int) -> bool:
+        task = self.tasks.get(job_id)
+        if not task:
+            return False
+        logger.info("Start Canceling sync job %d", job_id)
+        task.cancel()
+        return True
+
+    def prune(self):
+        finished = [job.id for job in self.jobs.values() if job.is_finished]
+        for job_id in finished[: max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
+
+    async def stop(self):
+        tasks = list(self.tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.progress_hub.stop()
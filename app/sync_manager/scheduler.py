@@ -0,0 +1,159 @@
+import asyncio
+import random
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlmodel import select
+
+from app.core import config
+from app.core.db import new_async_session
+from app.core.logging import get_logger
+from app.download_manager.manager import DownloadManager
+from app.download_manager.utils import add_playlists_tracks_to_download_manager
+from app.models.playlist import PlaylistModel
+from app.sync_manager.manager import SyncJobStatusEnum, SyncManager
+from app.sync_manager.sync import get_settings
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, only the in-process lock is used
+    fcntl = None
+
+logger = get_logger(__name__)
+
+# how often a disabled scheduler checks the settings again
+DISABLED_CHECK_INTERVAL = 60
+
+
+@contextmanager
+def process_lock(path: str) -> Iterator[bool]:
+    """Non-blocking exclusive lock, only one process of several workers
+    serving the same database runs a sync"""
+    if not fcntl:
+        yield True
+        return
+    with open(path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class SyncScheduler:
+    """Syncs the library and every playlist each `sync_interval` minutes.
+
+    The interval is read from the settings before every wait, so a change
+    through the settings api applies to the next run. Syncs go through the
+    `SyncManager` jobs, a playlist already syncing from the api isn't synced
+    twice.
+    """
+
+    def __init__(self, sync_manager: SyncManager, downloader: DownloadManager) -> None:
+        self.sync_manager = sync_manager
+        self.downloader = downloader
+        self.lock = asyncio.Lock()
+        self.task: asyncio.Task | None = None
+        self.last_run: datetime | None = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run_forever())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def get_delay(self) -> float | None:
+        async with new_async_session() as orm:
+            settings = await get_settings(orm)
+        interval = settings.sync_interval if settings else config.settings.sync_interval
+        if interval <= 0:
+            return None
+        # instances started together don't hit the api at the same moment
+        jitter = random.uniform(-1, 1) * config.settings.sync_jitter
+        return interval * 60 * (1 + jitter)
+
+    async def run_forever(self):
+        while True:
+            delay = await self.get_delay()
+            if delay is None:
+                await asyncio.sleep(DISABLED_CHECK_INTERVAL)
+                continue
+            logger.info("next library sync in %d seconds", delay)
+            await asyncio.sleep(delay)
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("library sync failed")
+
+    async def run_once(self) -> dict | None:
+        if self.lock.locked():
+            logger.info("library sync already running, skipped")
+            return None
+        async with self.lock:
+            with process_lock(config.settings.sync_lock_path) as acquired:
+                if not acquired:
+                    logger.info("library sync running in another process, skipped")
+                    return None
+                result = await self.sync()
+                self.last_run = datetime.now()
+                return result
+
+    async def sync(self) -> dict:
+        library_job = await self.sync_manager.wait(self.sync_manager.sync_library())
+        if library_job.status != SyncJobStatusEnum.SUCCESSFUL:
+            raise RuntimeError(
+                f"library sync job {library_job.id} {library_job.status}"
+            )
+
+        # unchanged playlists are skipped without any request
+        playlists_qs = (
+            select(PlaylistModel.id)
+            .where(PlaylistModel.service == "soundcloud")
+            .where(PlaylistModel.url.is_not(None))  # type: ignore
+            .order_by(PlaylistModel.id)
+        )
+        async with new_async_session() as orm:
+            playlists_ids = (await orm.exec(playlists_qs)).all()
+
+        # concurrency is bounded by the sync manager
+        jobs = await asyncio.gather(
+            *[
+                self.sync_manager.wait(self.sync_manager.sync_playlist(id))
+                for id in playlists_ids
+            ]
+        )
+        synced = [
+            job
+            for job in jobs
+            if job.status == SyncJobStatusEnum.SUCCESSFUL
+            and job.result
+            and not job.result["skipped"]
+        ]
+        failed = [job for job in jobs if job.status != SyncJobStatusEnum.SUCCESSFUL]
+        logger.info(
+            "library sync done playlists %d synced %d failed %d",
+            len(playlists_ids),
+            len(synced),
+            len(failed),
+        )
+
+        if config.settings.sync_auto_download:
+            await add_playlists_tracks_to_download_manager(
+                self.downloader, list(playlists_ids)
+            )
+
+        return {
+            "library": library_job.result,
+            "playlists": len(playlists_ids),
+            "synced_playlists": len(synced),
+            "failed_playlists": len(failed),
+        }
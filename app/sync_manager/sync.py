@@ -0,0 +1,255 @@
+from collections.abc import Callable
+from datetime import datetime
+
+from aiohttp import ClientSession
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import delete, or_, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core import config
+from app.core.logging import get_logger
+from app.models.playlist import (
+    PlaylistModel,
+    PlaylistSyncStateModel,
+    PlaylistTrackLinkModel,
+    TrackModel,
+)
+from app.models.settings import SettingsModel
+from app.schemas.playlist import TrackSchema
+from app.soundcloud.auth import call_with_auth
+from app.soundcloud.playlist import get_playlist_tracks_ids, get_playlists, get_tracks
+
+logger = get_logger(__name__)
+
+# called with (done, total) items of a sync
+SyncProgress = Callable[[int, int], None]
+
+# 8 columns per track, far below SQLite's 32766 variables per statement
+UPSERT_BATCH_SIZE = 1000
+
+
+class PlaylistSyncError(Exception):
+    """tracks of the playlist couldn't be read from its page"""
+
+
+async def get_settings(orm: AsyncSession) -> SettingsModel | None:
+    settings_query = select(SettingsModel)
+    return (await orm.exec(settings_query)).one_or_none()
+
+
+def get_oauth(settings: SettingsModel | None) -> str:
+    if settings:
+        return settings.get_soundcloud_oauth()
+    return config.settings.soundcloud_oauth
+
+
+async def sync_library(
+    orm: AsyncSession, session: ClientSession, settings: SettingsModel | None
+) -> dict:
+    """Create/update the playlists of the user library, tracks are synced by
+    `sync_playlist` for the returned `outdated_playlists`"""
+    res = await call_with_auth(
+        session, get_oauth(settings), lambda sc_auth: get_playlists(session, sc_auth)
+    )
+
+    items_id = [obj.platform_id for obj in res]
+    logger.info("palylists ids: %s", items_id)
+
+    search_query = (
+        select(PlaylistModel)
+        .where(PlaylistModel.service == "soundcloud")
+        .where(PlaylistModel.platform_id.in_(items_id))  # type: ignore
+    )
+    search_result = (await orm.exec(search_query)).fetchall()
+
+    lookup_objs = {obj.platform_id: obj for obj in search_result}
+    updated_items = []
+    created_items = []
+
+    for obj in res:
+        item = lookup_objs.get(str(obj.platform_id))
+        if item:
+            item.update_from_schema(obj)
+            updated_items.append(item)
+        else:
+            new_item = PlaylistModel.from_schema(obj)
+            new_item.service = "soundcloud"
+            orm.add(new_item)
+            created_items.append(new_item)
+
+    await orm.commit()
+
+    # playlists whose tracks changed since their last sync
+    outdated_query = (
+        select(PlaylistModel.id)
+        .outerjoin(PlaylistSyncStateModel)
+        .where(PlaylistModel.service == "soundcloud")
+        .where(PlaylistModel.platform_id.in_(items_id))  # type: ignore
+        .where(
+            or_(
+                PlaylistSyncStateModel.playlist_id.is_(None),  # type: ignore
+                PlaylistSyncStateModel.last_modified != PlaylistModel.last_modified,
+                PlaylistSyncStateModel.track_count != PlaylistModel.track_count,
+            )
+        )
+        .order_by(PlaylistModel.id)
+    )
+    outdated_ids = (await orm.exec(outdated_query)).all()
+
+    return {
+        "updated_playlists": len(updated_items),
+        "created_playlists": len(created_items),
+        "outdated_playlists": outdated_ids,
+        "total": len(res),
+    }
+
+
+async def sync_playlist(
+    orm: AsyncSession,
+    session: ClientSession,
+    settings: SettingsModel | None,
+    playlist_obj: PlaylistModel,
+    full: bool = False,
+    progress: SyncProgress | None = None,
+) -> dict:
+    """Link the tracks of the playlist page to `playlist_obj`, unchanged
+    playlists are skipped unless `full`. `progress` counts fetched tracks."""
+    id = playlist_obj.id
+    # `last_modified`/`track_count` are refreshed by the library sync
+    sync_state = await orm.get(PlaylistSyncStateModel, id)
+    if not full and sync_state and sync_state.is_up_to_date(playlist_obj):
+        logger.info("playlist %d unchanged since last sync, skipped", id)
+        return {
+            "created_tracks": 0,
+            "updated_tracks": 0,
+            "removed_tracks": 0,
+            "unchanged_tracks": playlist_obj.track_count,
+            "total": playlist_obj.track_count,
+            "skipped": True,
+        }
+
+    tracks_ids = await get_playlist_tracks_ids(playlist_obj.url or "", session)
+    if not tracks_ids and playlist_obj.track_count:
+        raise PlaylistSyncError("Playlist Tracks Couldn't Be Fetched")
+
+    page_ids = list(dict.fromkeys(tracks_ids))
+    known_statement = select(TrackModel.platform_id).where(
+        TrackModel.platform_id.in_(page_ids)  # type: ignore
+    )
+    known_ids = set((await orm.exec(known_statement)).all())
+
+    # only tracks unknown to the database are requested, unless `full`
+    missing_ids = [
+        track_id for track_id in page_ids if full or track_id not in known_ids
+    ]
+    fetched = 0
+
+    def on_batch(count: int):
+        nonlocal fetched
+        fetched += count
+        if progress:
+            progress(fetched, len(missing_ids))
+
+    if progress:
+        progress(0, len(missing_ids))
+    res = []
+    if missing_ids:
+        res = await call_with_auth(
+            session,
+            get_oauth(settings),
+            lambda sc_auth: get_tracks(
+                missing_ids, session, sc_auth, on_batch=on_batch
+            ),
+        )
+    logger.info(
+        "playlist %d tracks total %d requested %d fetched %d",
+        id,
+        len(page_ids),
+        len(missing_ids),
+        len(res),
+    )
+
+    # everything below is one transaction, reads between the writes are cheap
+    # indexed lookups of whole sets
+    await upsert_tracks(orm, res)
+
+    page_tracks_statement = select(TrackModel.id, TrackModel.platform_id).where(
+        TrackModel.platform_id.in_(page_ids)  # type: ignore
+    )
+    page_tracks = dict((await orm.exec(page_tracks_statement)).all())
+
+    linked_statement = (
+        select(TrackModel.id, TrackModel.platform_id)
+        .join(PlaylistTrackLinkModel)
+        .where(PlaylistTrackLinkModel.playlist_id == id)
+    )
+    linked_tracks = dict((await orm.exec(linked_statement)).all())
+
+    # unlinking relies on the page ids, a track of a failed batch stays linked
+    page_ids_set = set(page_ids)
+    link_ids = set(page_tracks) - set(linked_tracks)
+    unlink_ids = {
+        track_id
+        for track_id, platform_id in linked_tracks.items()
+        if platform_id not in page_ids_set
+    }
+
+    if link_ids:
+        link_statement = (
+            sqlite_insert(PlaylistTrackLinkModel)
+            .values(
+                [{"playlist_id": id, "track_id": track_id} for track_id in link_ids]
+            )
+            .on_conflict_do_nothing()
+        )
+        await orm.exec(link_statement)
+    if unlink_ids:
+        unlink_statement = (
+            delete(PlaylistTrackLinkModel)
+            .where(PlaylistTrackLinkModel.playlist_id == id)  # type: ignore
+            .where(PlaylistTrackLinkModel.track_id.in_(unlink_ids))  # type: ignore
+        )
+        await orm.exec(unlink_statement)
+
+    # a failed tracks batch is retried on the next sync
+    if len(res) == len(missing_ids):
+        if not sync_state:
+            sync_state = PlaylistSyncStateModel(
+                playlist_id=id,
+                last_modified=playlist_obj.last_modified,
+                track_count=playlist_obj.track_count,
+                synced_at=datetime.now(),
+            )
+        else:
+            sync_state.last_modified = playlist_obj.last_modified
+            sync_state.track_count = playlist_obj.track_count
+            sync_state.synced_at = datetime.now()
+        orm.add(sync_state)
+
+    await orm.commit()
+
+    created_ids = set(page_tracks.values()) - known_ids
+    unchanged = len(linked_tracks) - len(unlink_ids)
+    return {
+        "created_tracks": len(created_ids),
+        "updated_tracks": len(link_ids) - len(created_ids),
+        "removed_tracks": len(unlink_ids),
+        "unchanged_tracks": unchanged,
+        "total": unchanged + len(link_ids),
+        "skipped": False,
+    }
+
+
+async def upsert_tracks(orm: AsyncSession, tracks: list[TrackSchema]):
+    """Insert new tracks and refresh the metadata of known ones by
+    `platform_id`, in batches below the SQLite variables limit"""
+    columns = TrackSchema.model_fields.keys() - {"platform_id", "is_synced"}
+    for i in range(0, len(tracks), UPSERT_BATCH_SIZE):
+        statement = sqlite_insert(TrackModel).values(
+            [obj.model_dump() for obj in tracks[i : i + UPSERT_BATCH_SIZE]]
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[TrackModel.platform_id],
+            set_={column: statement.excluded[column] for column in columns},
+        )
+        await orm.exec(statement)
@@ -0,0 +1,148 @@
+"""Mixed read/write load on SQLite, default pragmas against the profile of
+`app.core.db`.
+
+Writers commit download status changes one at a time like the downloads do,
+readers page through the tracks with their download like the track listing.
+Both run on the async engine of the app for `--duration` seconds per profile.
+
+    python -m benchmarks.sqlite --writers 4 --readers 8 --duration 10
+"""
+
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.orm import joinedload
+from sqlmodel import SQLModel, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.core.config import settings
+from app.core.db import apply_sqlite_profile
+from app.models.playlist import DownloadStatusEnum, DownloadTrackModel, TrackModel
+
+PAGE_SIZE = 500
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[int(len(values) * fraction)] * 1000 if values else 0
+
+
+async def seed(engine: AsyncEngine, tracks: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    async with AsyncSession(engine) as orm:
+        orm.add_all(
+            TrackModel(
+                id=i,
+                platform_id=str(i),
+                url=f"https://soundcloud.com/t/{i}",
+                name=f"track {i}",
+                artist_name=None,
+                album=None,
+                duration=1,
+                is_synced=True,
+                thumbnail=None,
+            )
+            for i in range(1, tracks + 1)
+        )
+        orm.add_all(
+            DownloadTrackModel(
+                id=i, status=DownloadStatusEnum.PENDING, file_path=None, track_id=i
+            )
+            for i in range(1, tracks + 1)
+        )
+        await orm.commit()
+
+
+async def writer(engine: AsyncEngine, tracks: int, deadline: float, stats: dict):
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            async with AsyncSession(engine) as orm:
+                await orm.exec(
+                    update(DownloadTrackModel)  # type: ignore
+                    .where(DownloadTrackModel.id == random.randint(1, tracks))  # type: ignore
+                    .values(status=random.choice(list(DownloadStatusEnum)))
+                )
+                await orm.commit()
+        except Exception:  # noqa: BLE001
+            stats["errors"] += 1
+            continue
+        stats["writes"].append(time.perf_counter() - started)
+
+
+async def reader(engine: AsyncEngine, tracks: int, deadline: float, stats: dict):
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            async with AsyncSession(engine) as orm:
+                query = (
+                    select(TrackModel)
+                    .options(joinedload(TrackModel.download))  # type: ignore
+                    .where(TrackModel.id > random.randint(0, tracks - PAGE_SIZE))  # type: ignore
+                    .order_by(TrackModel.id)
+                    .limit(PAGE_SIZE)
+                )
+                (await orm.exec(query)).all()
+        except Exception:  # noqa: BLE001
+            stats["errors"] += 1
+            continue
+        stats["reads"].append(time.perf_counter() - started)
+
+
+async def run_profile(args: argparse.Namespace, path: Path, tuned: bool) -> dict:
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{path}",
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+    )
+    if tuned:
+        apply_sqlite_profile(engine.sync_engine)
+    await seed(engine, args.tracks)
+    stats = {"reads": [], "writes": [], "errors": 0}
+    deadline = time.monotonic() + args.duration
+    await asyncio.gather(
+        *(writer(engine, args.tracks, deadline, stats) for _ in range(args.writers)),
+        *(reader(engine, args.tracks, deadline, stats) for _ in range(args.readers)),
+    )
+    await engine.dispose()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.partition("\n\n")[0])
+    parser.add_argument("--tracks", type=int, default=20_000)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    args = parser.parse_args()
+
+    print(
+        f"{args.tracks} tracks, {args.writers} writers, {args.readers} readers, "
+        f"{args.duration:g} s"
+    )
+    print(
+        f"{'profile':<10}{'writes/s':>10}{'p95 ms':>10}{'reads/s':>10}"
+        f"{'p95 ms':>10}{'errors':>8}"
+    )
+    for name, tuned in [("default", False), ("tuned", True)]:
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "bench.sqlite3"
+            stats = asyncio.run(run_profile(args, path, tuned))
+        print(
+            f"{name:<10}{len(stats['writes']) / args.duration:>10.0f}"
+            f"{percentile(stats['writes'], 0.95):>10.1f}"
+            f"{len(stats['reads']) / args.duration:>10.0f}"
+            f"{percentile(stats['reads'], 0.95):>10.1f}"
+            f"{stats['errors']:>8}",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Concurrent listeners of the player stream, the old generator against
+`RangeFileResponse`.
+
+Each mode runs in its own single worker server and every listener downloads
+the whole file at once, so the numbers are the most a worker can push. The
+listeners it can hold at a given bitrate follow from the throughput, the
+server CPU per GB shows what each listener costs the event loop.
+
+    python -m benchmarks.streaming --listeners 1 10 50 --server uvicorn
+    python -m benchmarks.streaming --server granian  # pathsend, needs granian
+
+uvicorn has no zero-copy extension so `range` is the chunked `pread` path
+there, granian supports `pathsend` which is the zero-copy path of full-file
+responses. The server CPU is read from /proc, Linux only.
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+from app.http.responses import RangeFileResponse
+
+FILE_PATH_ENV = "BENCH_STREAM_FILE"
+CHUNK_SIZE = 1024 * 1024
+# of a 320 kbps MP3
+BITRATE = 320_000 / 8
+
+app = FastAPI()
+
+
+def file_streamer(file_path: Path, start: int, end: int, chunk_size: int):
+    # the generator of the player before RangeFileResponse
+    total_size = end - start
+    with open(file_path, "rb") as file:
+        file.seek(start)
+        while total_size >= 0:
+            total_size -= chunk_size
+            yield file.read(chunk_size)
+
+
+@app.get("/generator")
+async def generator():
+    path = Path(os.environ[FILE_PATH_ENV])
+    size = path.stat().st_size
+    return StreamingResponse(
+        file_streamer(path, 0, size, CHUNK_SIZE),
+        media_type="audio/mpeg",
+        headers={"Content-Length": str(size)},
+    )
+
+
+@app.get("/range")
+async def range_file(zero_copy: bool = True):
+    path = Path(os.environ[FILE_PATH_ENV])
+    return RangeFileResponse(
+        path,
+        path.stat().st_size,
+        "audio/mpeg",
+        chunk_size=CHUNK_SIZE,
+        zero_copy=zero_copy,
+    )
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def server_command(server: str, port: int) -> list[str]:
+    if server == "granian":
+        return [
+            sys.executable,
+            "-m",
+            "granian",
+            "--interface",
+            "asgi",
+            "--port",
+            str(port),
+            "--workers",
+            "1",
+            "--log-level",
+            "warning",
+            "benchmarks.streaming:app",
+        ]
+    return [
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "--port",
+        str(port),
+        "--workers",
+        "1",
+        "--log-level",
+        "warning",
+        "benchmarks.streaming:app",
+    ]
+
+
+def cpu_seconds(pid: int) -> float:
+    """Of the server and its worker processes"""
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rpartition(")")[2].split()
+    # utime and stime, fields 14 and 15 of proc_pid_stat(5)
+    seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    for task in Path(f"/proc/{pid}/task").iterdir():
+        for child in (task / "children").read_text().split():
+            seconds += cpu_seconds(int(child))
+    return seconds
+
+
+async def listen(session: aiohttp.ClientSession, url: str) -> tuple[float, int]:
+    started = time.perf_counter()
+    first_byte = None
+    received = 0
+    async with session.get(url) as response:
+        response.raise_for_status()
+        async for chunk in response.content.iter_chunked(256 * 1024):
+            first_byte = first_byte or time.perf_counter() - started
+            received += len(chunk)
+    return first_byte or 0, received
+
+
+async def run_load(url: str, listeners: int, rounds: int) -> tuple[float, list, int]:
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await listen(session, url)  # warm up
+        started = time.perf_counter()
+        results = []
+        for _ in range(rounds):
+            results += await asyncio.gather(
+                *(listen(session, url) for _ in range(listeners))
+            )
+        elapsed = time.perf_counter() - started
+    return elapsed, sorted(ttfb for ttfb, _ in results), sum(n for _, n in results)
+
+
+async def wait_ready(url: str, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.head(url):
+                    return
+            except aiohttp.ClientError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+
+def bench(args: argparse.Namespace, path: Path, mode: str) -> list[str]:
+    port = free_port()
+    env = {**os.environ, FILE_PATH_ENV: str(path)}
+    server = subprocess.Popen(server_command(args.server, port), env=env)
+    rows = []
+    try:
+        url = f"http://127.0.0.1:{port}/{mode}"
+        if mode == "chunked":
+            url = f"http://127.0.0.1:{port}/range?zero_copy=false"
+        asyncio.run(wait_ready(url))
+        for listeners in args.listeners:
+            cpu = cpu_seconds(server.pid)
+            elapsed, ttfb, received = asyncio.run(run_load(url, listeners, args.rounds))
+            cpu = cpu_seconds(server.pid) - cpu
+            throughput = received / elapsed
+            rows.append(
+                f"{mode:<10}{listeners:>10}{throughput / 2**20:>12.0f}"
+                f"{cpu / (received / 2**30):>12.2f}"
+                f"{ttfb[int(len(ttfb) * 0.95)] * 1000:>12.1f}"
+                f"{throughput / BITRATE:>14.0f}"
+            )
+            print(rows[-1], flush=True)
+    finally:
+        server.terminate()
+        server.wait()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.partition("\n\n")[0])
+    parser.add_argument("--server", choices=["uvicorn", "granian"], default="uvicorn")
+    parser.add_argument("--listeners", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--file-size", type=int, default=8, help="MB")
+    parser.add_argument("--modes", nargs="+", default=["generator", "chunked", "range"])
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(suffix=".mp3") as file:
+        file.write(os.urandom(args.file_size * 2**20))
+        file.flush()
+        print(f"{args.server}, {args.file_size} MB file, {args.rounds} rounds")
+        print(
+            f"{'mode':<10}{'listeners':>10}{'MB/s':>12}{'CPU s/GB':>12}"
+            f"{'p95 TTFB ms':>12}{'at 320kbps':>14}"
+        )
+        for mode in args.modes:
+            bench(args, Path(file.name), mode)
+
+
+if __name__ == "__main__":
+    main()
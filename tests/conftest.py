@@ -0,0 +1,40 @@
+import os
+import tempfile
+
+# settings are read on import, keep the logs and the default database of the
+# app away from the real ones
+TEST_DIR = tempfile.mkdtemp(prefix="sync-me-tests-")
+os.environ.setdefault("LOGS_PATH", TEST_DIR)
+os.environ.setdefault("DB_URL", f"sqlite:///{TEST_DIR}/db.sqlite3")
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+# tables of the models
+from app.models import playlist, settings  # noqa: F401
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def engine():
+    # one in-memory database shared by every session of a test
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+def new_session(engine: AsyncEngine):
+    def new_session() -> AsyncSession:
+        return AsyncSession(engine, expire_on_commit=False)
+
+    return new_session
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+
+from app.core import config
+from app.download_manager import manager
+from app.download_manager.manager import (
+    NORMAL_PRIORITY,
+    DownloadContext,
+    DownloadManager,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def engine(tmp_path):
+    # workers run their transactions at once, they need connections of their
+    # own rather than the single one of the in-memory database
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/db.sqlite3")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def queue_session(monkeypatch, new_session):
+    monkeypatch.setattr(manager, "new_async_session", new_session)
+    monkeypatch.setattr(config.settings, "download_queue_poll_interval", 0.01)
+    monkeypatch.setattr(config.settings, "download_autotune", False)
+
+
+async def test_worker_survives_queue_errors(monkeypatch):
+    downloaded = []
+
+    async def download(ctx: DownloadContext):
+        downloaded.append(ctx.download_id)
+
+    download_manager = DownloadManager(2, download)
+    claim = download_manager.queue.claim
+    failures = 2
+
+    async def failing_claim():
+        nonlocal failures
+        if failures:
+            failures -= 1
+            raise OSError("database is locked")
+        return await claim()
+
+    monkeypatch.setattr(download_manager.queue, "claim", failing_claim)
+    download_manager.start()
+    try:
+        await asyncio.sleep(0.05)
+        assert len(download_manager.workers) == 2
+        await download_manager.add_to_queue([1], NORMAL_PRIORITY)
+        await asyncio.sleep(0.05)
+        assert downloaded == [1]
+    finally:
+        await download_manager.stop()
+
+
+async def test_download_outlives_renew_errors(monkeypatch):
+    finished = asyncio.Event()
+    downloads = 0
+
+    async def download(ctx: DownloadContext):
+        nonlocal downloads
+        downloads += 1
+        await asyncio.sleep(0.1)
+        finished.set()
+
+    async def failing_renew(job):
+        raise OSError("database is locked")
+
+    download_manager = DownloadManager(1, download)
+    download_manager.queue.lease_duration = 0.03
+    monkeypatch.setattr(download_manager.queue, "renew", failing_renew)
+    await download_manager.add_to_queue([1], NORMAL_PRIORITY)
+    job = await download_manager.queue.claim()
+    assert job is not None
+
+    await download_manager.run_job(job)
+
+    assert finished.is_set()
+    assert downloads == 1
+    assert await download_manager.queue.claim() is None
+    await download_manager.stop()
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from app.download_manager import manager
+from app.download_manager.manager import (
+    HIGH_PRIORITY,
+    LOW_PRIORITY,
+    NORMAL_PRIORITY,
+    DownloadQueue,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture(autouse=True)
+def queue_session(monkeypatch, new_session):
+    monkeypatch.setattr(manager, "new_async_session", new_session)
+
+
+def new_queue(lease_duration: float = 60, aging_interval: float = 3600):
+    return DownloadQueue(aging_interval=aging_interval, lease_duration=lease_duration)
+
+
+async def claim_all(queue: DownloadQueue) -> list[int]:
+    download_ids = []
+    while job := await queue.claim():
+        download_ids.append(job.download_id)
+    return download_ids
+
+
+async def test_claim_by_priority_then_fifo():
+    queue = new_queue()
+    await queue.put([1, 2], NORMAL_PRIORITY)
+    await queue.put([3], LOW_PRIORITY)
+    await queue.put([4], HIGH_PRIORITY)
+
+    assert await claim_all(queue) == [4, 1, 2, 3]
+    assert not await queue.has_ready_jobs()
+
+
+async def test_waiting_job_gains_priority():
+    queue = new_queue(aging_interval=0.005)
+    await queue.put([1], LOW_PRIORITY)
+    # more than LOW_PRIORITY - HIGH_PRIORITY intervals
+    await asyncio.sleep(0.1)
+    await queue.put([2], HIGH_PRIORITY)
+
+    assert await claim_all(queue) == [1, 2]
+
+
+async def test_claimed_job_is_not_claimed_again():
+    queue, other = new_queue(), new_queue()
+    await queue.put([1], NORMAL_PRIORITY)
+
+    job = await queue.claim()
+
+    assert job is not None
+    assert job.attempts == 1
+    assert job.lease_owner == queue.owner
+    assert await other.claim() is None
+    # queuing it again doesn't touch the running job
+    await other.put([1], HIGH_PRIORITY)
+    assert await other.claim() is None
+
+
+async def test_retry_after_delay():
+    queue = new_queue()
+    await queue.put([1], NORMAL_PRIORITY)
+    job = await queue.claim()
+    assert job is not None
+
+    assert await queue.retry(job, delay=60)
+    assert await queue.claim() is None
+    assert not await queue.has_ready_jobs()
+
+    # a job retried with no delay is ready at once
+    await queue.put([1], NORMAL_PRIORITY)
+    job = await queue.claim()
+    assert job is not None
+    assert await queue.retry(job, delay=0)
+    retried = await queue.claim()
+    assert retried is not None
+    assert retried.id == job.id
+    assert retried.attempts == 2
+
+
+async def test_expired_lease_is_claimed_again():
+    crashed, queue = new_queue(lease_duration=0), new_queue()
+    await queue.put([1], NORMAL_PRIORITY)
+    job = await crashed.claim()
+    assert job is not None
+    await asyncio.sleep(0.01)
+
+    reclaimed = await queue.claim()
+
+    assert reclaimed is not None
+    assert reclaimed.id == job.id
+    assert reclaimed.attempts == 2
+    assert reclaimed.lease_owner == queue.owner
+    # the previous owner lost the job
+    assert not await crashed.renew(job)
+    assert not await crashed.retry(job, delay=0)
+    await crashed.finish(job)
+    assert await queue.renew(reclaimed)
+    await queue.finish(reclaimed)
+    assert await queue.claim() is None
+
+
+async def test_released_job_keeps_its_attempts():
+    queue = new_queue()
+    await queue.put([1], NORMAL_PRIORITY)
+    job = await queue.claim()
+    assert job is not None
+
+    assert await queue.release(job)
+
+    released = await queue.claim()
+    assert released is not None
+    assert released.attempts == 1
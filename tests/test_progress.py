@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from app.core.progress import ProgressHub
+from app.download_manager.manager import DownloadProgressReport, is_report_final
+from app.models.playlist import DownloadStatusEnum
+
+pytestmark = pytest.mark.anyio
+
+
+def read(message: str) -> dict:
+    return json.loads(message.rpartition("data: ")[2])
+
+
+async def test_only_notified_entries_are_sent():
+    reports = {i: DownloadProgressReport(track_id=i) for i in range(3)}
+    hub = ProgressHub(reports, interval=0)
+    with hub.subscribe() as subscriber:
+        assert read(await subscriber.get()).keys() == {"0", "1", "2"}
+
+        reports[0].percent = 50
+        reports[1].percent = 50
+        hub.notify(1)
+        hub.publish()
+
+        assert read(await subscriber.get()) == {
+            "1": {"track_id": 1, "percent": 50, "status": "downloading"}
+        }
+        reports.pop(2)
+        hub.notify(2)
+        hub.publish()
+        assert read(await subscriber.get()) == {"2": None}
+    await hub.stop()
+
+
+async def test_final_entries_are_pruned_once_sent():
+    reports = {1: DownloadProgressReport(track_id=1)}
+    hub = ProgressHub(reports, interval=0, expired=is_report_final)
+    with hub.subscribe() as subscriber:
+        await subscriber.get()
+
+        reports[1].status = DownloadStatusEnum.SUCCESSFUL
+        reports[2] = DownloadProgressReport(track_id=2)
+        hub.notify(1, 2)
+        hub.publish()
+
+        assert read(await subscriber.get()) == {
+            "1": {"track_id": 1, "percent": 0, "status": "successful"},
+            "2": {"track_id": 2, "percent": 0, "status": "downloading"},
+        }
+        assert reports.keys() == {2}
+        assert hub.entries.keys() == {2}
+    await hub.stop()
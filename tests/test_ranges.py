@@ -0,0 +1,83 @@
+import pytest
+
+from app.http.ranges import (
+    MAX_RANGES,
+    RangeNotSatisfiable,
+    if_range_matches,
+    parse_range_header,
+)
+
+ETAG = '"abc"'
+LAST_MODIFIED = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+
+@pytest.mark.parametrize(
+    ("header", "expected"),
+    [
+        ("bytes=0-99", [(0, 100)]),
+        ("bytes=100-", [(100, 1000)]),
+        ("bytes=-100", [(900, 1000)]),
+        # past the end is clamped to the file
+        ("bytes=900-5000", [(900, 1000)]),
+        ("bytes=-5000", [(0, 1000)]),
+        ("Bytes = 0-0", [(0, 1)]),
+        ("bytes=0-9, 20-29", [(0, 10), (20, 30)]),
+        # sorted, overlapping and adjacent ranges merged
+        ("bytes=20-29,0-9,5-14", [(0, 15), (20, 30)]),
+        ("bytes=0-9,10-19", [(0, 20)]),
+        ("bytes=0-9,-10", [(0, 10), (990, 1000)]),
+        # unsatisfiable ranges are dropped if another one overlaps the file
+        ("bytes=0-9,2000-2999", [(0, 10)]),
+    ],
+)
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, 1000) == expected
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        "items=0-9",
+        "bytes=",
+        "bytes=-",
+        "bytes=abc",
+        "bytes=9-0",
+        "bytes=0-9;1-2",
+        "bytes=" + ",".join(["0-0"] * (MAX_RANGES + 1)),
+    ],
+)
+def test_ignored_range_header(header):
+    assert parse_range_header(header, 1000) is None
+
+
+@pytest.mark.parametrize(
+    ("header", "file_size"),
+    [
+        ("bytes=1000-", 1000),
+        ("bytes=1000-1999,3000-", 1000),
+        ("bytes=-0", 1000),
+        ("bytes=-10", 0),
+        ("bytes=0-", 0),
+    ],
+)
+def test_unsatisfiable_range(header, file_size):
+    with pytest.raises(RangeNotSatisfiable) as error:
+        parse_range_header(header, file_size)
+    assert error.value.file_size == file_size
+
+
+@pytest.mark.parametrize(
+    ("if_range", "expected"),
+    [
+        (None, True),
+        (ETAG, True),
+        (f" {ETAG} ", True),
+        ('"other"', False),
+        # weak validators never allow a partial response
+        (f"W/{ETAG}", False),
+        (LAST_MODIFIED, True),
+        ("Thu, 22 Oct 2015 07:28:00 GMT", False),
+    ],
+)
+def test_if_range_matches(if_range, expected):
+    assert if_range_matches(if_range, ETAG, LAST_MODIFIED) is expected
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import pytest
+
+from app.soundcloud import auth
+from app.soundcloud.auth import SoundCloudAuth, SoundCloudAuthError, call_with_auth
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def client_ids(monkeypatch):
+    """client_id of every credentials fetch, a new one once invalidated"""
+    fetched: list[str] = []
+    cache = auth.credentials_cache
+
+    async def get(session):
+        if cache.fetched_at == datetime.min:
+            cache.client_id = f"id-{len(fetched)}"
+            cache.fetched_at = datetime.now()
+            fetched.append(cache.client_id)
+        return cache.client_id, "1"
+
+    monkeypatch.setattr(cache, "get", get)
+    monkeypatch.setattr(cache, "client_id", "")
+    monkeypatch.setattr(cache, "fetched_at", datetime.min)
+    return fetched
+
+
+async def test_rejected_call_is_retried_with_new_credentials(client_ids):
+    calls = []
+
+    async def call(sc_auth: SoundCloudAuth) -> str:
+        calls.append(sc_auth.client_id)
+        if sc_auth.client_id == "id-0":
+            raise SoundCloudAuthError("url", 401)
+        return "ok"
+
+    assert await call_with_auth(None, "", call) == "ok"  # type: ignore
+    assert calls == ["id-0", "id-1"]
+
+
+async def test_second_rejection_reaches_the_caller(client_ids):
+    calls = []
+
+    async def call(sc_auth: SoundCloudAuth):
+        calls.append(sc_auth.client_id)
+        raise SoundCloudAuthError("url", 403)
+
+    with pytest.raises(SoundCloudAuthError):
+        await call_with_auth(None, "", call)  # type: ignore
+    assert calls == ["id-0", "id-1"]
@@ -0,0 +1,86 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import pytest
+
+from app.soundcloud import playlist
+from app.soundcloud.auth import SoundCloudAuth, SoundCloudAuthError
+
+pytestmark = pytest.mark.anyio
+
+AUTH = SoundCloudAuth(app_version="1", client_id="id")
+
+
+class FakeResponse:
+    def __init__(self, status: int, body: dict | None = None) -> None:
+        self.status = status
+        self.body = json.dumps(body or {}).encode()
+
+    async def read(self) -> bytes:
+        return self.body
+
+
+class FakeSession:
+    """Answers a request with the handler of the first route in its url"""
+
+    def __init__(self, routes) -> None:
+        self.routes = routes
+
+    @asynccontextmanager
+    async def get(self, url: str):
+        for route, handler in self.routes.items():
+            if route in url:
+                yield await handler()
+                return
+        raise AssertionError(f"unexpected request {url}")
+
+
+async def test_failed_fallback_cancels_the_others():
+    started = asyncio.Event()
+    slow: list[asyncio.Task] = []
+
+    async def library():
+        # playlists without artwork are fetched one by one
+        return FakeResponse(
+            200, {"collection": [{"playlist": {"id": i}} for i in (1, 2)]}
+        )
+
+    async def rejected():
+        await started.wait()
+        return FakeResponse(401)
+
+    async def pending():
+        slow.append(asyncio.current_task())  # type: ignore
+        started.set()
+        await asyncio.sleep(60)
+        return FakeResponse(500)
+
+    session = FakeSession(
+        {
+            "/me/library/all": library,
+            "/playlists/1?": rejected,
+            "/playlists/2?": pending,
+        }
+    )
+
+    with pytest.raises(SoundCloudAuthError):
+        await playlist.get_playlists(session, AUTH)  # type: ignore
+
+    assert slow and slow[0].cancelled()
+
+
+async def test_tracks_batch_doesnt_wait_after_last_attempt(monkeypatch):
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    async def failing():
+        return FakeResponse(500)
+
+    monkeypatch.setattr(playlist.asyncio, "sleep", sleep)
+    session = FakeSession({"/tracks?": failing})
+
+    assert await playlist.get_tracks_batch("1,2", session, AUTH, retries=3) == []  # type: ignore
+    assert delays == [1, 2]
@@ -0,0 +1,121 @@
+from datetime import datetime
+
+import httpx
+import pytest
+from sqlalchemy import event
+
+from app.core.db import get_async_session
+from app.main import app
+from app.models.playlist import (
+    DownloadStatusEnum,
+    DownloadTrackModel,
+    PlaylistModel,
+    PlaylistTrackLinkModel,
+    TrackModel,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def client(new_session):
+    async def get_test_session():
+        async with new_session() as session:
+            yield session
+
+    app.dependency_overrides[get_async_session] = get_test_session
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def statements(engine):
+    executed: list[str] = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count)
+    yield executed
+    event.remove(engine.sync_engine, "before_cursor_execute", count)
+
+
+async def add_playlist(
+    new_session,
+    tracks_count: int,
+    status: DownloadStatusEnum = DownloadStatusEnum.SUCCESSFUL,
+) -> int:
+    async with new_session() as orm:
+        playlist = PlaylistModel(
+            platform_id="p",
+            url="https://soundcloud.com/p",
+            name="p",
+            owner=None,
+            track_count=tracks_count,
+            duration=1,
+            thumbnail=None,
+            is_synced=True,
+            last_modified=datetime.now(),
+            service="soundcloud",
+        )
+        tracks = [
+            TrackModel(
+                platform_id=str(i),
+                url=f"https://soundcloud.com/t/{i}",
+                name=f"track {i}",
+                artist_name=None,
+                album=None,
+                duration=1,
+                is_synced=True,
+                thumbnail=None,
+            )
+            for i in range(tracks_count)
+        ]
+        orm.add(playlist)
+        orm.add_all(tracks)
+        await orm.commit()
+        for i, track in enumerate(tracks):
+            orm.add(PlaylistTrackLinkModel(playlist_id=playlist.id, track_id=track.id))
+            # every other track is downloaded
+            if i % 2:
+                orm.add(
+                    DownloadTrackModel(
+                        status=status,
+                        file_path=f"/music/{i}.mp3",
+                        track_id=track.id,  # type: ignore
+                    )
+                )
+        await orm.commit()
+        return playlist.id  # type: ignore
+
+
+@pytest.mark.parametrize("tracks_count", [1, 20])
+async def test_playlist_tracks_in_one_query(
+    client, new_session, statements, tracks_count
+):
+    playlist_id = await add_playlist(new_session, tracks_count)
+    statements.clear()
+
+    response = await client.get(f"/api/playlists/{playlist_id}/tracks/?limit=50")
+
+    assert response.status_code == 200
+    tracks = response.json()
+    assert len(tracks) == tracks_count
+    assert sum(track["download"] is not None for track in tracks) == tracks_count // 2
+    selects = [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+    assert len(selects) == 1, selects
+
+
+async def test_downloads_in_one_query(client, new_session, statements):
+    # the listing leaves the successful downloads out
+    await add_playlist(new_session, 20, DownloadStatusEnum.FAILED)
+    statements.clear()
+
+    response = await client.get("/api/downloads/?limit=50")
+
+    assert response.status_code == 200
+    assert len(response.json()) == 10
+    selects = [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+    assert len(selects) == 1, selects